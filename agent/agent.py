@@ -1,14 +1,33 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import os
-import shutil
-from typing import List
+import json
+import logging
+from dataclasses import replace
+from typing import List, Optional
 
-from llm.generate import generate_stream
-from handler.response import answer
-from doc_knowledge.vectordb_utils import QdrantFileUploader
+from llm.generate import generate_stream, llm_queue_depth, llm_saturated
+from llm.scheduler import SchedulerBusy
+from handler.response import answer, answer_events, prepare_answer, NO_ANSWER_MESSAGE
+from handler.answer_cache import lookup_answer, record_answer, stream_cached
+from handler.ingest import IngestionQueue
+from handler.concurrency import BoundedExecutor, Overloaded
+from doc_knowledge.storage import default_storage
+from doc_knowledge.config import (
+    WARMUP_MODELS, ANSWER_WORKERS, ANSWER_MAX_PENDING,
+    UPLOAD_CHUNK_SIZE, RETRY_AFTER_SECONDS
+)
+from registry import models
+from metrics import render as render_metrics
+from tracing import Trace, resume, traced_iter
+
+logging.basicConfig(
+    level=os.environ.get("DEEPDOC_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
 
 app = FastAPI(
     title="Document QA Agent",
@@ -26,36 +45,193 @@ app.add_middleware(
 UPLOAD_DIR = "Collections"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+ingest_queue = IngestionQueue()
+
+# Retrieval, rerank, dựng prompt, summary chạy trên pool riêng;
+# event loop chỉ nhận request và stream kết quả
+answer_pool = BoundedExecutor("answer", ANSWER_WORKERS, ANSWER_MAX_PENDING)
+
+@app.on_event("startup")
+def warmup_models():
+    # Model chỉ load khi dùng lần đầu, trừ các model khai báo trong DEEPDOC_WARMUP
+    models.warmup(*WARMUP_MODELS)
+
+@app.on_event("shutdown")
+def shutdown_ingest_queue():
+    ingest_queue.shutdown()
+    answer_pool.shutdown()
+
+@app.exception_handler(Overloaded)
+@app.exception_handler(SchedulerBusy)
+async def overloaded(request: Request, exc: Exception):
+    depth = getattr(exc, "depth", None)
+    if depth is None:
+        depth = llm_queue_depth()
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "queue_depth": depth},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
 class GenerateRequest(BaseModel):
     question: str
     file_names: List[str]
 
-@app.post("/generate")
-def generate(req: GenerateRequest):
+def _answer_stream(req: GenerateRequest):
+    cached = lookup_answer(req.question, req.file_names)
+    if cached is not None:
+        return stream_cached(cached)
+
     prompt = answer(req.question, req.file_names)
-    print(prompt)
+    if prompt is None:
+        return stream_cached(NO_ANSWER_MESSAGE)
+
+    return record_answer(req.question, req.file_names, generate_stream(prompt))
+
+def _traced_answer_stream(tr: Trace, req: GenerateRequest):
+    with resume(tr):
+        return _answer_stream(req)
+
+def _traced_prepare_answer(tr: Trace, req: GenerateRequest):
+    with resume(tr):
+        return prepare_answer(req.question, req.file_names)
+
+def _check_llm_capacity():
+    # LLM đã đầy hàng đợi → từ chối trước khi tốn công retrieval
+    if llm_saturated():
+        raise Overloaded("Inference queue is full", llm_queue_depth())
+
+@app.post("/generate")
+async def generate(req: GenerateRequest):
+    _check_llm_capacity()
+
+    # Trace kéo dài tới khi stream xong để tính cả thời gian LLM
+    tr = Trace("generate")
+    try:
+        stream = await answer_pool.run(_traced_answer_stream, tr, req)
+    except Exception:
+        tr.status = "error"
+        tr.finish()
+        raise
+
+    # Token stream chỉ chờ queue của scheduler → iterate trên threadpool mặc định
     return StreamingResponse(
-        generate_stream(prompt),
+        traced_iter(tr, stream),
         media_type="text/plain"
     )
+@app.post("/generate/events")
+async def generate_events(req: GenerateRequest):
+    _check_llm_capacity()
+
+    # Retrieval + chọn strategy trên answer_pool; map phase và token chỉ chờ
+    # scheduler → iterate trên threadpool mặc định như /generate
+    tr = Trace("generate_events")
+    try:
+        prepared = await answer_pool.run(_traced_prepare_answer, tr, req)
+    except Exception:
+        tr.status = "error"
+        tr.finish()
+        raise
+
+    # NDJSON: retrieval, từng page summary, rồi token của câu trả lời cuối
+    def _ndjson():
+        try:
+            for event in answer_events(req.question, req.file_names, prepared):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except SchedulerBusy as e:
+            # Response đã bắt đầu (status 200) → không trả 429 được nữa,
+            # báo lỗi bằng 1 event cuối để client tự retry
+            yield json.dumps({
+                "event": "error",
+                "status": 429,
+                "detail": str(e),
+                "retry_after": RETRY_AFTER_SECONDS
+            }) + "\n"
+
+    return StreamingResponse(
+        traced_iter(tr, _ndjson()),
+        media_type="application/x-ndjson"
+    )
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus text format
+    return PlainTextResponse(
+        render_metrics(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+async def _save_upload(file: UploadFile, file_path: str):
+    # Đọc/ghi từng chunk, thao tác đĩa chạy ngoài event loop
+    buffer = await run_in_threadpool(open, file_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await run_in_threadpool(buffer.write, chunk)
+    finally:
+        await run_in_threadpool(buffer.close)
+        await file.close()
+
+def _storage_options(dim, quantization, on_disk):
+    # Không truyền gì → collection mới dùng mặc định, collection cũ giữ nguyên
+    options = {
+        k: v for k, v in
+        {"dim": dim, "quantization": quantization, "on_disk": on_disk}.items()
+        if v is not None
+    }
+    if not options:
+        return None
+    if options.get("quantization") == "none":
+        options["quantization"] = None
+    try:
+        return replace(default_storage(), **options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/files")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    dim: Optional[int] = None,
+    quantization: Optional[str] = None,
+    on_disk: Optional[bool] = None
+):
+    storage = _storage_options(dim, quantization, on_disk)
+
+    # Hàng đợi ingest đầy → 429 trước khi ghi file
+    if not ingest_queue.has_capacity(len(files)):
+        raise Overloaded("Ingestion queue is full", ingest_queue.pending())
+
     uploaded_files = []
-    collections = []
+    file_paths = []
 
     for file in files:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
+        file_name = os.path.basename(file.filename)
+        file_path = os.path.join(UPLOAD_DIR, file_name)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await _save_upload(file, file_path)
 
-        collection_name = QdrantFileUploader().upload_file(file_path)
+        uploaded_files.append(file_name)
+        file_paths.append(file_path)
 
-        uploaded_files.append(file.filename)
-        collections.append(collection_name)
+    # Ingest chạy nền, client poll trạng thái qua /jobs/{job_id}
+    job = ingest_queue.submit(file_paths, storage)
 
     return {
-        "message": "Uploaded successfully",
+        "message": "Uploaded successfully, indexing in background",
+        "job_id": job["job_id"],
         "files": uploaded_files,
-        "collections": collections
+        "collections": [f["collection"] for f in job["files"]]
     }
+
+@app.get("/jobs")
+def list_jobs():
+    return ingest_queue.list()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
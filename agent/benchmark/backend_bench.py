@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+# Chạy từ thư mục agent/: python -m benchmark.backend_bench --backends int8,onnx
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed/rerank backend throughput + parity")
+    parser.add_argument("--backends", default="int8,onnx,compile")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--pairs", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="ghi kết quả JSON")
+    return parser.parse_args()
+
+
+def _throughput(fn, n: int) -> float:
+    fn()   # warmup (compile / export)
+    start = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("DEEPDOC_DEVICE", "cpu")
+
+    from doc_knowledge.config import EMBED_MODEL_NAME, RANK_MODEL_NAME, device
+    from doc_knowledge.backends import (
+        build_embed_model, build_rank_model, embed_parity, rank_parity
+    )
+    from benchmark.corpus import make_passages
+
+    rng = random.Random(args.seed)
+    texts = make_passages(rng, args.texts)
+    pairs = [(rng.choice(texts), rng.choice(texts)) for _ in range(args.pairs)]
+
+    report = {"device": device, "embed": {}, "rerank": {}}
+    backends = ["torch"] + [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    ref_embed = ref_rank = None
+    for backend in backends:
+        embed = build_embed_model(EMBED_MODEL_NAME, device, backend)
+        rank = build_rank_model(RANK_MODEL_NAME, device, backend)
+        if ref_embed is None:
+            ref_embed, ref_rank = embed, rank
+
+        report["embed"][backend] = {
+            "texts_per_s": round(_throughput(
+                lambda: embed.encode(texts, batch_size=args.batch_size, normalize_embeddings=True),
+                len(texts)
+            ), 2),
+            "min_cosine": round(embed_parity(ref_embed, embed, texts[:32]), 5),
+        }
+        report["rerank"][backend] = {
+            "pairs_per_s": round(_throughput(
+                lambda: rank.predict(pairs, batch_size=args.batch_size),
+                len(pairs)
+            ), 2),
+            "max_score_diff": round(rank_parity(ref_rank, rank, texts[:8]), 5),
+        }
+        print(backend, report["embed"][backend], report["rerank"][backend])
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nĐã ghi kết quả vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import random
+import textwrap
+from typing import List, Tuple
+
+from docx import Document
+from pptx import Presentation
+from pptx.util import Inches, Pt
+
+
+# =========================
+# SYNTHETIC CONTENT
+# =========================
+FILLER = (
+    "policy review annual budget committee report section article clause "
+    "provision schedule amendment regulation compliance audit procedure "
+    "department office meeting notice record archive summary appendix "
+    "transition period implementation guidance reference document scope"
+).split()
+
+FIRST = ["Alder", "Brina", "Corvin", "Delia", "Emrys", "Fenna", "Galen", "Hester",
+         "Ivor", "Juna", "Kester", "Lorna", "Marek", "Nerys", "Osric", "Perrin"]
+LAST = ["Voss", "Hale", "Marsh", "Quill", "Thorne", "Wren", "Ashby", "Crane",
+        "Doyle", "Fairfax", "Garrow", "Holt", "Ingram", "Kettle", "Lowe", "Morrow"]
+TOPICS = ["supply", "lease", "maintenance", "consulting", "insurance", "licensing"]
+CITIES = ["Hanoi", "Lisbon", "Oslo", "Quito", "Tallinn", "Valletta", "Zagreb"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+
+PARAS_PER_PAGE = 20   # khớp cách file_loader gom paragraph DOCX thành page
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    text = " ".join(rng.choice(FILLER) for _ in range(words))
+    return text.capitalize() + "."
+
+
+def _fact(rng: random.Random, used: set) -> Tuple[str, str]:
+    while True:
+        name = f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+        topic = rng.choice(TOPICS)
+        if (name, topic) not in used:
+            used.add((name, topic))
+            break
+    code = f"{rng.choice('ABCDEFGH')}{rng.randint(1000, 9999)}"
+    fact = (
+        f"The {topic} contract for {name} was signed in {rng.choice(CITIES)} "
+        f"on {rng.randint(1, 28)} {rng.choice(MONTHS)} {rng.randint(2005, 2024)} "
+        f"with reference code {code}."
+    )
+    question = f"What is the reference code of the {topic} contract for {name}?"
+    return fact, question
+
+
+def _page_paragraphs(rng: random.Random, fact: str) -> List[str]:
+    paras = [_sentence(rng) for _ in range(PARAS_PER_PAGE)]
+    paras[rng.randrange(PARAS_PER_PAGE)] = fact
+    return paras
+
+
+# =========================
+# WRITERS
+# =========================
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    # PDF tối giản (Helvetica, text ASCII) để không phụ thuộc thư viện tạo PDF
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,   # Pages, điền sau khi biết id các page
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for paras in pages:
+        lines = []
+        for para in paras:
+            lines.extend(textwrap.wrap(para, 95) or [""])
+        ops = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        ops += [f"({_pdf_escape(line)}) Tj T*" for line in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref
+    )
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_docx(path: str, pages: List[List[str]]):
+    doc = Document()
+    for paras in pages:
+        for para in paras:
+            doc.add_paragraph(para)
+    doc.save(path)
+
+
+def write_pptx(path: str, pages: List[List[str]]):
+    pres = Presentation()
+    layout = pres.slide_layouts[6]   # blank
+    for paras in pages:
+        slide = pres.slides.add_slide(layout)
+        box = slide.shapes.add_textbox(Inches(0.3), Inches(0.3), Inches(9.4), Inches(6.9))
+        frame = box.text_frame
+        frame.word_wrap = True
+        frame.text = paras[0]
+        for para in paras[1:]:
+            frame.add_paragraph().text = para
+        for p in frame.paragraphs:
+            for run in p.runs:
+                run.font.size = Pt(8)
+    pres.save(path)
+
+
+WRITERS = {"pdf": write_pdf, "docx": write_docx, "pptx": write_pptx}
+
+
+# =========================
+# CORPUS
+# =========================
+def build_corpus(
+    out_dir: str,
+    docs: int,
+    pages: int,
+    formats: List[str],
+    seed: int = 0
+):
+    # Trả về (danh sách file, danh sách (question, collection, page 1-based))
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    files, labels, used = [], [], set()
+    for d in range(docs):
+        ext = formats[d % len(formats)]
+        path = os.path.join(out_dir, f"bench_{d:03d}.{ext}")
+
+        doc_pages = []
+        for p in range(pages):
+            fact, question = _fact(rng, used)
+            doc_pages.append(_page_paragraphs(rng, fact))
+            labels.append((question, f"doc_{os.path.basename(path)}", p + 1))
+
+        WRITERS[ext](path, doc_pages)
+        files.append(path)
+
+    return files, labels
+
+
+# =========================
+# PASSAGES (BENCHMARK EMBED / RERANK)
+# =========================
+def make_passages(rng: random.Random, n: int) -> List[str]:
+    # Đoạn văn ngắn: cứ 4 đoạn có 1 câu fact, còn lại là filler
+    used = set()
+    return [
+        _fact(rng, used)[0] if i % 4 == 0 else " ".join(_sentence(rng) for _ in range(6))
+        for i in range(n)
+    ]
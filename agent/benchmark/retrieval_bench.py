@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+from collections import defaultdict
+from dataclasses import replace
+
+# Chạy từ thư mục agent/: python -m benchmark.retrieval_bench
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEARCH_STAGES = [
+    "search.embed",
+    "search.chunk_search",
+    "search.page_fetch",
+    "search.rerank",
+    "search.related_search",
+    "search.ner",
+    "search.highlight",
+    "search.gc",
+]
+INGEST_STAGES = [
+    "ingest.parse",
+    "ingest.embed",
+    "ingest.ner",
+    "ingest.upsert",
+]
+
+
+def percentile(values, q):
+    # Nearest-rank percentile
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def summarize(samples, stages):
+    rows = {}
+    for stage in ["total"] + stages:
+        values = [s.get(stage, 0.0) * 1000 for s in samples]
+        rows[stage] = {
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        }
+    return rows
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'stage':<24}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'mean ms':>12}")
+    for stage, r in rows.items():
+        print(
+            f"{stage:<24}{r['p50_ms']:>12.2f}{r['p95_ms']:>12.2f}"
+            f"{r['p99_ms']:>12.2f}{r['mean_ms']:>12.2f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DOCSearcher retrieval benchmark")
+    parser.add_argument("--docs", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--formats", default="pdf,docx,pptx")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--chunk-topk", type=int, default=10)
+    parser.add_argument("--page-topk", type=int, default=3)
+    parser.add_argument("--related-topk", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dim", type=int, default=None,
+                        help="số chiều lưu vector (Matryoshka), mặc định theo config")
+    parser.add_argument("--quantization", choices=["none", "scalar", "binary"], default=None)
+    parser.add_argument("--cache", action="store_true",
+                        help="giữ cache giữa các query (mặc định xóa để đo cold path)")
+    parser.add_argument("--real-models", action="store_true",
+                        help="dùng model thật thay cho stand-in (cần tải weight)")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None, help="ghi kết quả JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Qdrant + manifest riêng cho benchmark, set trước khi import config
+    workdir = args.workdir or tempfile.mkdtemp(prefix="deepdoc_bench_")
+    os.environ["DEEPDOC_QDRANT_PATH"] = os.path.join(workdir, "knowledge")
+    os.environ.setdefault("DEEPDOC_DEVICE", "cpu")
+
+    from registry import models
+    from tracing import trace
+    from doc_knowledge.vectordb_utils import QdrantFileUploader
+    from doc_knowledge.search_utils import DOCSearcher, clear_caches
+    from doc_knowledge.storage import default_storage
+    from benchmark.corpus import build_corpus
+    from benchmark.standins import install_standins
+
+    if not args.real_models:
+        install_standins(models)
+
+    # ===== 1. Sinh corpus =====
+    files, labels = build_corpus(
+        os.path.join(workdir, "corpus"),
+        args.docs,
+        args.pages,
+        [f.strip() for f in args.formats.split(",") if f.strip()],
+        args.seed
+    )
+    print(f"Corpus: {len(files)} files x {args.pages} pages in {workdir}")
+
+    # ===== 2. Ingest =====
+    storage = default_storage()
+    if args.dim:
+        storage = replace(storage, dim=args.dim)
+    if args.quantization:
+        storage = replace(
+            storage,
+            quantization=None if args.quantization == "none" else args.quantization
+        )
+
+    uploader = QdrantFileUploader()
+    ingest_samples, collections = [], []
+    for path in files:
+        with trace("ingest") as tr:
+            start = time.perf_counter()
+            collections.append(uploader.upload_file(path, storage=storage))
+            sample = tr.totals()
+            sample["total"] = time.perf_counter() - start
+        ingest_samples.append(sample)
+
+    # ===== 3. Replay query =====
+    rng = random.Random(args.seed)
+    queries = [rng.choice(labels) for _ in range(args.queries)]
+    searcher = DOCSearcher(
+        collections=collections,
+        chunk_topk=args.chunk_topk,
+        page_topk=args.page_topk,
+        related_topk=args.related_topk
+    )
+
+    search_samples = []
+    hits = defaultdict(int)
+    for question, collection, page in queries:
+        if not args.cache:
+            clear_caches()
+        with trace("search") as tr:
+            start = time.perf_counter()
+            results = searcher.search(question)
+            sample = tr.totals()
+            sample["total"] = time.perf_counter() - start
+        search_samples.append(sample)
+
+        for item in results:
+            if item["collection"] == collection and item["page"] == page:
+                for k in range(item["rank"], args.page_topk + 1):
+                    hits[k] += 1
+                break
+
+    # ===== 4. Report =====
+    report = {
+        "config": vars(args),
+        "ingest": summarize(ingest_samples, INGEST_STAGES),
+        "search": summarize(search_samples, SEARCH_STAGES),
+        "recall": {
+            f"recall@{k}": round(hits[k] / len(queries), 4)
+            for k in range(1, args.page_topk + 1)
+        } if queries else {},
+    }
+
+    print_table("INGEST (per file)", report["ingest"])
+    print_table("SEARCH (per query)", report["search"])
+    print("\nRECALL")
+    for name, value in report["recall"].items():
+        print(f"{name:<24}{value:>12.4f}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nĐã ghi kết quả vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import re
+import zlib
+import numpy as np
+
+
+# =========================
+# STAND-IN MODELS (CPU, OFFLINE)
+# =========================
+# Cùng interface với model thật nhưng không cần tải weight,
+# dùng để benchmark pipeline (Qdrant, cache, highlight...) một cách tái lập được
+
+def _tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for row, text in enumerate(sentences):
+            toks = _tokens(text)
+            for feat in toks + [a + "_" + b for a, b in zip(toks, toks[1:])]:
+                h = zlib.crc32(feat.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out = out / np.maximum(norms, 1e-12)
+        return out
+
+
+class LexicalReranker:
+    def predict(self, pairs, batch_size=32, **kwargs):
+        scores = []
+        for query, text in pairs:
+            q = set(_tokens(query))
+            t = set(_tokens(text))
+            scores.append(len(q & t) / len(q) if q else 0.0)
+        return np.asarray(scores, dtype=np.float32)
+
+
+class RegexNER:
+    _pattern = re.compile(r"\b(?:[A-Z][a-z]+)(?: [A-Z][a-z]+)+\b")
+
+    def _find(self, text):
+        return [{"word": m.group(0)} for m in self._pattern.finditer(text)]
+
+    def __call__(self, texts, batch_size=None, **kwargs):
+        if isinstance(texts, str):
+            return self._find(texts)
+        return [self._find(t) for t in texts]
+
+
+def install_standins(models, dim: int = 1024):
+    models.register("embed", lambda: HashingEmbedder(dim))
+    models.register("rerank", LexicalReranker)
+    models.register("ner", RegexNER)
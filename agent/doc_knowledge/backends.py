@@ -0,0 +1,132 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+# torch   : model gốc (fp32 trên CPU)
+# int8    : dynamic quantization các lớp Linear (chỉ CPU)
+# onnx    : ONNX Runtime qua sentence-transformers (cần optimum[onnxruntime])
+# openvino: OpenVINO qua sentence-transformers (cần optimum[openvino])
+# compile : torch.compile phần transformer
+BACKENDS = ("torch", "int8", "onnx", "openvino", "compile")
+
+PARITY_TEXTS = [
+    "The supply contract was signed in Hanoi on 12 March 2021.",
+    "Hợp đồng thuê nhà được ký tại Hà Nội ngày 5 tháng 6 năm 2019.",
+    "Annual budget review of the compliance department.",
+    "Reference code B4821 applies to the maintenance agreement.",
+    "Contact: lan.nguyen@example.com, +84 912 345 678.",
+    "Điều 3. Thời hạn hợp đồng là 24 tháng kể từ ngày ký.",
+]
+
+
+def _check_backend(backend: str, device: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    if backend == "int8" and device != "cpu":
+        print(f"Backend 'int8' chỉ hỗ trợ CPU, dùng 'torch' trên {device}")
+        return "torch"
+    return backend
+
+
+def _quantize(module: torch.nn.Module) -> torch.nn.Module:
+    return torch.quantization.quantize_dynamic(
+        module, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+# =========================
+# EMBEDDING
+# =========================
+def build_embed_model(name: str, device: str, backend: str = "torch"):
+    from sentence_transformers import SentenceTransformer
+
+    backend = _check_backend(backend, device)
+    if backend in ("onnx", "openvino"):
+        try:
+            return SentenceTransformer(name, device=device, backend=backend)
+        except Exception as e:
+            # Thiếu optimum / export lỗi → quay về model gốc
+            print(f"Backend '{backend}' lỗi cho {name}: {e}, dùng 'torch'")
+            backend = "torch"
+
+    model = SentenceTransformer(name, device=device)
+    if backend == "int8":
+        model = _quantize(model)
+    elif backend == "compile":
+        model[0].auto_model = torch.compile(model[0].auto_model, dynamic=True)
+    return model
+
+
+# =========================
+# RERANK
+# =========================
+def build_rank_model(name: str, device: str, backend: str = "torch"):
+    from sentence_transformers import CrossEncoder
+
+    backend = _check_backend(backend, device)
+    rank_model = None
+    if backend in ("onnx", "openvino"):
+        try:
+            rank_model = CrossEncoder(name, device=device, backend=backend)
+        except Exception as e:
+            print(f"Backend '{backend}' lỗi cho {name}: {e}, dùng 'torch'")
+            backend = "torch"
+
+    if rank_model is None:
+        rank_model = CrossEncoder(name, device=device)
+
+    # Qwen reranker không có pad token
+    rank_model.tokenizer.pad_token = rank_model.tokenizer.eos_token
+    rank_model.model.config.pad_token_id = rank_model.tokenizer.eos_token_id
+
+    if backend == "int8":
+        rank_model.model = _quantize(rank_model.model)
+    elif backend == "compile":
+        rank_model.model = torch.compile(rank_model.model, dynamic=True)
+    return rank_model
+
+
+# =========================
+# PARITY CHECK
+# =========================
+def embed_parity(reference, candidate, texts: Sequence[str] = PARITY_TEXTS) -> float:
+    # Cosine nhỏ nhất giữa embedding của model gốc và backend
+    ref = reference.encode(list(texts), normalize_embeddings=True)
+    out = candidate.encode(list(texts), normalize_embeddings=True)
+    return float(np.min(np.sum(np.asarray(ref) * np.asarray(out), axis=1)))
+
+
+def _parity_pairs(texts: Sequence[str]) -> List[Tuple[str, str]]:
+    return [(q, t) for q in texts[:3] for t in texts]
+
+
+def rank_parity(reference, candidate, texts: Sequence[str] = PARITY_TEXTS) -> float:
+    # Chênh lệch score lớn nhất giữa model gốc và backend
+    pairs = _parity_pairs(texts)
+    ref = np.asarray(reference.predict(pairs), dtype=np.float32)
+    out = np.asarray(candidate.predict(pairs), dtype=np.float32)
+    return float(np.max(np.abs(ref - out)))
+
+
+def checked(kind: str, build, name: str, device: str, backend: str, tolerance: float):
+    # Load backend, so với model gốc; lệch quá tolerance → dùng model gốc
+    candidate = build(name, device, backend)
+    if backend == "torch":
+        return candidate
+
+    reference = build(name, device, "torch")
+    if kind == "embed":
+        value = embed_parity(reference, candidate)
+        ok = value >= 1.0 - tolerance
+        print(f"Parity {kind}/{backend}: min cosine {value:.4f} (tolerance {tolerance})")
+    else:
+        value = rank_parity(reference, candidate)
+        ok = value <= tolerance
+        print(f"Parity {kind}/{backend}: max score diff {value:.4f} (tolerance {tolerance})")
+
+    if not ok:
+        print(f"Backend '{backend}' lệch quá tolerance, dùng 'torch' cho {kind}")
+        return reference
+    del reference
+    return candidate
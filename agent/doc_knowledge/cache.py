@@ -0,0 +1,103 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+
+
+# =========================
+# LRU CACHE (THREAD-SAFE, TTL)
+# =========================
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expire_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expire_at, value = item
+            if expire_at is not None and expire_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expire_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self):
+        # Snapshot các entry còn hạn, không đổi thứ tự LRU
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (expire_at, value) in self._data.items()
+                if expire_at is None or expire_at >= now
+            ]
+
+    def invalidate(self, predicate):
+        # Xóa mọi entry có key thỏa predicate(key)
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# =========================
+# SEMANTIC CACHE (COSINE)
+# =========================
+class SemanticCache:
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        maxsize: int = 512,
+        ttl: Optional[float] = None
+    ):
+        self.threshold = threshold
+        # scope -> (embedding, value); scope gom theo tập collection + version
+        self._entries = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def lookup(self, scope, embedding):
+        query = np.asarray(embedding, dtype=np.float32)
+        best, best_key, best_score = None, None, self.threshold
+
+        for key, (emb, value) in self._entries.items():
+            if key[0] != scope:
+                continue
+            # Embedding đã normalize → dot = cosine
+            score = float(np.dot(query, emb))
+            if score >= best_score:
+                best, best_key, best_score = value, key, score
+
+        if best_key is not None:
+            self._entries.get(best_key)   # đánh dấu vừa dùng
+        return best
+
+    def store(self, scope, key, embedding, value):
+        emb = np.asarray(embedding, dtype=np.float32)
+        self._entries.put((scope, key), (emb, value))
+
+    def invalidate(self, predicate):
+        self._entries.invalidate(lambda key: predicate(key[0]))
+
+    def clear(self):
+        self._entries.clear()
@@ -1,32 +1,138 @@
 import os
-import torch
-from sentence_transformers import SentenceTransformer, CrossEncoder
-from transformers import pipeline
 from qdrant_client import QdrantClient
 
+from registry import models, select_device
+from doc_knowledge.backends import build_embed_model, build_rank_model, checked
+
 COLLECTIONS = "./collections/"
 # Cấu hình Qdrant
-QDRANT_PATH = "./knowledge"
+QDRANT_PATH = os.environ.get("DEEPDOC_QDRANT_PATH", "./knowledge")
 os.makedirs(QDRANT_PATH, exist_ok=True)
-CLIENT = QdrantClient(path=QDRANT_PATH)
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# DEEPDOC_QDRANT_URL → dùng Qdrant server; không có → local mode (QDRANT_PATH)
+QDRANT_URL = os.environ.get("DEEPDOC_QDRANT_URL")
+CLIENT = QdrantClient(url=QDRANT_URL) if QDRANT_URL else QdrantClient(path=QDRANT_PATH)
+# Manifest hash theo từng page: local mode lưu file trong MANIFEST_PATH,
+# server mode lưu thành 1 point trong chính collection (các node dùng chung)
+MANIFEST_PATH = os.path.join(QDRANT_PATH, "manifests")
+os.makedirs(MANIFEST_PATH, exist_ok=True)
+device = select_device()
 
-embed_model = SentenceTransformer(
-    "Qwen/Qwen3-Embedding-0.6B",
-    device=device
-)
+# Model warmup lúc khởi động, vd. DEEPDOC_WARMUP="embed,rerank,ner,llm_scheduler"
+# Worker chỉ ingest không cần (và sẽ không bao giờ load) LLM
+WARMUP_MODELS = [m for m in os.environ.get("DEEPDOC_WARMUP", "").split(",") if m]
+
+# Cấu hình ingest
+EMBED_BATCH_SIZE = 64      # số text / lần encode
+UPSERT_BATCH_SIZE = 256    # số point / lần upsert
+INGEST_WINDOW_PAGES = 32   # số page xử lý đồng thời khi ingest (giới hạn RAM)
+INGEST_PARSE_WORKERS = os.cpu_count() or 1   # số process parse file song song (1 = tuần tự)
+INGEST_PREFETCH_WINDOWS = 2   # số window page parse trước khi tới lượt embed (mỗi file)
+INGEST_MAX_JOBS = 1000     # số job giữ lại để tra cứu trạng thái
+INGEST_MAX_PENDING_FILES = 64   # số file chờ/đang ingest tối đa (quá → 429)
+
+# Cấu hình search
+SEARCH_WORKERS = 8         # số collection search đồng thời
+NER_BATCH_SIZE = 16        # số đoạn text / batch NER
+DATE_LANGUAGES = None      # ngôn ngữ cho dateparser; None = tự nhận diện, vd. ["en", "vi"] nhanh hơn
+RERANK_BATCH_SIZE = 16     # batch tối đa của cross-encoder
+RERANK_CACHE_SIZE = 4096   # số cặp (query, page) giữ trong cache
+QUERY_CACHE_SIZE = 1024    # số embedding câu hỏi giữ trong cache
+ENTITY_CACHE_SIZE = 2048   # số page (collection cũ) giữ entity NER lúc query
+SEARCH_CACHE_SIZE = 256    # số kết quả search giữ trong cache
+SEARCH_CACHE_TTL = 600     # giây
+HIGHLIGHT_NER_MAX_CHARS = 4000   # NER lúc query (collection cũ) chỉ chạy trên phần đầu page
+
+# Cấu hình lưu vector mặc định cho collection mới (chọn riêng được khi upload_file).
+# Local mode chỉ áp dụng dim; quantization / on_disk / HNSW cần Qdrant server
+EMBED_DIM = 1024             # số chiều đầy đủ của Qwen3-Embedding-0.6B
+STORAGE_DIM = 1024           # Matryoshka: giữ N chiều đầu (1..1024)
+STORAGE_QUANTIZATION = None  # None | "scalar" (int8, ~4x) | "binary" (1 bit, ~32x)
+STORAGE_ON_DISK = False      # vector gốc trên đĩa, vector quantized giữ trong RAM
+HNSW_M = 16
+HNSW_EF_CONSTRUCT = 100
+SEARCH_HNSW_EF = 128
+QUANTIZATION_OVERSAMPLING = 2.0   # lấy dư ứng viên rồi rescore bằng vector gốc
+
+# Semantic cache cho câu trả lời cuối (opt-in)
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_THRESHOLD = 0.92   # cosine tối thiểu để dùng lại câu trả lời
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_CACHE_TTL = 3600         # giây
+
+# Cấu hình API: event loop chỉ làm I/O, phần CPU/GPU chạy trên executor riêng
+ANSWER_WORKERS = 4         # số request retrieval + dựng prompt chạy đồng thời
+ANSWER_MAX_PENDING = 16    # số request answer chờ/đang chạy tối đa (quá → 429)
+UPLOAD_CHUNK_SIZE = 1 << 20   # byte / lần đọc-ghi file upload
+RETRY_AFTER_SECONDS = 5    # header Retry-After khi trả 429
+
+# =========================
+# MODELS (LAZY, LOAD KHI DÙNG LẦN ĐẦU)
+# =========================
+EMBED_MODEL_NAME = "Qwen/Qwen3-Embedding-0.6B"
+RANK_MODEL_NAME = "Qwen/Qwen3-Reranker-0.6B"
+NER_MODEL_NAME = "Babelscape/wikineural-multilingual-ner"
+
+# Backend inference: torch | int8 | onnx | openvino | compile (xem backends.py)
+EMBED_BACKEND = os.environ.get("DEEPDOC_EMBED_BACKEND", "torch")
+RANK_BACKEND = os.environ.get("DEEPDOC_RANK_BACKEND", "torch")
+# So backend với model gốc lúc load, lệch quá tolerance → dùng model gốc
+BACKEND_PARITY_CHECK = os.environ.get("DEEPDOC_BACKEND_PARITY", "1") == "1"
+EMBED_PARITY_TOLERANCE = 0.01   # 1 - cosine tối thiểu
+RANK_PARITY_TOLERANCE = 0.05    # chênh lệch score tối đa
+
+
+def _load_embed_model():
+    if BACKEND_PARITY_CHECK:
+        return checked(
+            "embed", build_embed_model, EMBED_MODEL_NAME,
+            device, EMBED_BACKEND, EMBED_PARITY_TOLERANCE
+        )
+    return build_embed_model(EMBED_MODEL_NAME, device, EMBED_BACKEND)
 
-rank_model = CrossEncoder(
-    "Qwen/Qwen3-Reranker-0.6B",
-    device=device
-)
 
-rank_model.tokenizer.pad_token = rank_model.tokenizer.eos_token
-rank_model.model.config.pad_token_id = rank_model.tokenizer.eos_token_id
+def _load_rank_model():
+    if BACKEND_PARITY_CHECK:
+        return checked(
+            "rerank", build_rank_model, RANK_MODEL_NAME,
+            device, RANK_BACKEND, RANK_PARITY_TOLERANCE
+        )
+    return build_rank_model(RANK_MODEL_NAME, device, RANK_BACKEND)
 
-ner_multi = pipeline(
+
+def _load_ner():
+    from transformers import pipeline
+    return pipeline(
+        "ner",
+        model=NER_MODEL_NAME,
+        grouped_entities=True,
+        device=0 if device == "cuda" else -1
+    )
+
+
+models.register(
+    "embed",
+    _load_embed_model,
+    warmup=lambda m: m.encode(["warmup"], normalize_embeddings=True)
+)
+models.register(
+    "rerank",
+    _load_rank_model,
+    warmup=lambda m: m.predict([("warmup", "warmup")])
+)
+models.register(
     "ner",
-    model="Babelscape/wikineural-multilingual-ner",
-    grouped_entities=True,
-    device=0 if device == "cuda" else -1
+    _load_ner,
+    warmup=lambda m: m("warmup")
 )
+
+
+def get_embed_model():
+    return models.get("embed")
+
+
+def get_rank_model():
+    return models.get("rerank")
+
+
+def get_ner():
+    return models.get("ner")
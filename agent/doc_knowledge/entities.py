@@ -1,16 +1,63 @@
 import re
+import pkgutil
+import importlib
+from functools import lru_cache
 from dateparser.search import search_dates
+import dateparser.data.date_translation_data as date_data
 import phonenumbers
 from email_validator import validate_email, EmailNotValidError
-from doc_knowledge.config import ner_multi
+from doc_knowledge.config import get_ner, NER_BATCH_SIZE, DATE_LANGUAGES
 
 
 # =========================
 # DATE (MULTI-LANG)
 # =========================
-def extract_dates(text, languages=None):
+# Chỉ đưa cho dateparser các câu có chữ số hoặc tên tháng (mọi ngôn ngữ
+# dateparser hỗ trợ); quét cả page bằng search_dates là phần chậm nhất
+# của NER lúc ingest
+_MONTHS = (
+    "january", "february", "march", "april", "may", "june", "july",
+    "august", "september", "october", "november", "december"
+)
+# Không cắt sau chữ số + dấu chấm ("3. Februar 2020", "12. 3. 2021")
+_SEGMENT_SPLIT = re.compile(r"(?<=[^\d\s][.;!?])\s+|\n+")
+_DIGIT = re.compile(r"\d")
+
+
+@lru_cache(maxsize=1)
+def _month_words():
+    words = set()
+    for module in pkgutil.iter_modules(date_data.__path__):
+        info = importlib.import_module(f"{date_data.__name__}.{module.name}").info
+        for key in _MONTHS:
+            for name in info.get(key, []):
+                words.update(
+                    w for w in re.findall(r"\w+", name.lower())
+                    if len(w) >= 3 and not w.isdigit()
+                )
+    return frozenset(words)
+
+
+def _has_date_hint(seg):
+    if _DIGIT.search(seg):
+        return True
+    return not _month_words().isdisjoint(re.findall(r"\w+", seg.lower()))
+
+
+def _date_candidates(text):
+    return "\n".join(
+        seg for seg in _SEGMENT_SPLIT.split(text)
+        if seg.strip() and _has_date_hint(seg)
+    )
+
+
+def extract_dates(text, languages=DATE_LANGUAGES):
     dates = set()
 
+    text = _date_candidates(text)
+    if not text:
+        return dates
+
     found = search_dates(
         text,
         languages=languages,   # None = auto detect
@@ -62,40 +109,82 @@ def extract_phones(text):
 # =========================
 # ENTITY EXTRACTOR (MAIN)
 # =========================
-def extract_entities(
-    text: str,
+_SPACE = re.compile(r"\s")
+
+
+def _windows(text, max_len, overlap):
+    # Cửa sổ trượt phủ toàn bộ page, chồng lấn để không cắt mất entity;
+    # biên cửa sổ lùi/tiến về khoảng trắng gần nhất để không cắt giữa từ
+    if len(text) <= max_len:
+        return [text]
+
+    windows, start = [], 0
+    while True:
+        end = start + max_len
+        if end >= len(text):
+            windows.append(text[start:])
+            return windows
+
+        cut = max(text.rfind(c, start + max_len // 2, end) for c in " \n\t")
+        if cut > start:
+            end = cut
+        windows.append(text[start:end])
+
+        m = _SPACE.search(text, end - overlap, end)
+        start = m.end() if m and m.end() > start else end - overlap
+
+
+def extract_entities_batch(
+    texts,
     max_len: int = 1200,
-    languages=None
+    overlap: int = 100,
+    batch_size: int = NER_BATCH_SIZE,
+    languages=DATE_LANGUAGES
 ):
-    text = text[:max_len]
-    ents = set()
-
-    # -------- NER (MULTI-LANG) --------
-    for e in ner_multi(text):
-        w = e.get("word", "").strip()
-        if w:
-            ents.add(w)
+    results = [set() for _ in texts]
+
+    # -------- NER (MULTI-LANG, BATCHED) --------
+    owners, windows = [], []
+    for idx, text in enumerate(texts):
+        for w in _windows(text, max_len, overlap):
+            if w.strip():
+                owners.append(idx)
+                windows.append(w)
+
+    if windows:
+        for idx, found in zip(owners, get_ner()(windows, batch_size=batch_size)):
+            for e in found:
+                w = e.get("word", "").strip()
+                if w:
+                    results[idx].add(w)
 
     # -------- DATE / EMAIL / PHONE --------
-    ents |= extract_dates(text, languages)
-    ents |= extract_emails(text)
-    ents |= extract_phones(text)
+    for idx, text in enumerate(texts):
+        results[idx] |= extract_dates(text, languages)
+        results[idx] |= extract_emails(text)
+        results[idx] |= extract_phones(text)
 
-    return sorted(ents, key=len, reverse=True)
+    return [sorted(ents, key=len, reverse=True) for ents in results]
+
+
+def extract_entities(
+    text: str,
+    max_len: int = 1200,
+    languages=DATE_LANGUAGES
+):
+    return extract_entities_batch([text], max_len=max_len, languages=languages)[0]
 
 
 # =========================
 # MARKDOWN HIGHLIGHT
 # =========================
 def highlight_markdown(text, entities):
-    for e in entities:
-        if not e.strip():
-            continue
+    # Một regex cho tất cả entity, dài trước để ưu tiên match dài nhất
+    terms = sorted({e for e in entities if e.strip()}, key=len, reverse=True)
+    if not terms:
+        return text
 
-        text = re.sub(
-            rf"(?<!\*)({re.escape(e)})(?!\*)",
-            r"**\1**",
-            text
-        )
-
-    return text
+    pattern = re.compile(
+        rf"(?<!\*)(?:{'|'.join(re.escape(e) for e in terms)})(?!\*)"
+    )
+    return pattern.sub(lambda m: f"**{m.group(0)}**", text)
@@ -1,39 +1,147 @@
-from typing import List
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
 from pypdf import PdfReader
 from docx import Document
 from pptx import Presentation
 
-def load_file_pages(path: str) -> List[str]:
-    ext = path.split('.')[-1].lower()
+SUPPORTED_EXTS = ("pdf", "docx", "pptx")
+
+# Số page PDF mỗi task khi parse song song. Chỉ PDF đọc được theo dải page
+# mà không parse lại cả file; DOCX/PPTX phải load toàn bộ XML mỗi lần mở,
+# nên chia task chỉ làm parse lặp lại N lần → luôn parse tuần tự
+PDF_PAGES_PER_TASK = 16
+
+# =========================
+# PARSE POOL (DÙNG CHUNG)
+# =========================
+# Một process pool cho cả process. Dùng spawn: fork từ API process (đã có
+# thread scheduler, thread pool của torch, model đã load) dễ deadlock ở
+# process con và nhân đôi bộ nhớ khi copy-on-write
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def parse_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+def shutdown_parse_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
 
+# =========================
+# UNIT READERS
+# =========================
+# Đơn vị: PDF = page, DOCX = paragraph khác rỗng, PPTX = slide
+def _iter_units(path: str, ext: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
     if ext == "pdf":
         reader = PdfReader(path)
-        return [p.extract_text() or "" for p in reader.pages]
+        for p in islice(reader.pages, start, end):
+            yield p.extract_text() or ""
+        return
 
     if ext == "docx":
         doc = Document(path)
-        pages, buf, cnt = [], [], 0
-        for para in doc.paragraphs:
+        for para in islice(doc.paragraphs, start, end):
             if para.text.strip():
-                buf.append(para.text.strip())
-                cnt += 1
-            if cnt >= 20:
-                pages.append("\n".join(buf))
-                buf, cnt = [], 0
-        if buf:
-            pages.append("\n".join(buf))
-        return pages
+                yield para.text.strip()
+        return
 
     if ext == "pptx":
         pres = Presentation(path)
-        pages = []
-        for slide in pres.slides:
+        for slide in islice(pres.slides, start, end):
             texts = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
-            pages.append("\n".join(texts))
-        return pages
+            yield "\n".join(texts)
+        return
 
     raise ValueError("Unsupported file")
 
+def _parse_pdf_range(path: str, start: int, end: int) -> List[str]:
+    # Chạy trong worker process
+    return list(_iter_units(path, "pdf", start, end))
+
+def _iter_pdf_parallel(
+    path: str,
+    workers: int,
+    executor: Optional[Executor]
+) -> Iterator[str]:
+    total = len(PdfReader(path).pages)
+    step = PDF_PAGES_PER_TASK
+    tasks = [(path, s, min(s + step, total)) for s in range(0, total, step)]
+
+    # File nhỏ → parse trực tiếp, không tốn chi phí process
+    if len(tasks) <= 1:
+        yield from _iter_units(path, "pdf")
+        return
+
+    executor = executor or parse_pool(workers)
+    max_inflight = 2 * (getattr(executor, "_max_workers", None) or workers)
+
+    # Giữ tối đa max_inflight task, trả kết quả đúng thứ tự
+    it = iter(tasks)
+    pending = deque(executor.submit(_parse_pdf_range, *t) for t in islice(it, max_inflight))
+    try:
+        while pending:
+            units = pending.popleft().result()
+            for t in islice(it, 1):
+                pending.append(executor.submit(_parse_pdf_range, *t))
+            yield from units
+    finally:
+        # Dừng giữa chừng → bỏ các task chưa chạy
+        for future in pending:
+            future.cancel()
+
+def _group_paragraphs(paras: Iterable[str], size: int = 20) -> Iterator[str]:
+    buf = []
+    for text in paras:
+        buf.append(text)
+        if len(buf) >= size:
+            yield "\n".join(buf)
+            buf = []
+    if buf:
+        yield "\n".join(buf)
+
+# =========================
+# PAGE LOADER
+# =========================
+def iter_file_pages(
+    path: str,
+    workers: int = 1,
+    executor: Optional[Executor] = None
+) -> Iterator[str]:
+    ext = path.split('.')[-1].lower()
+    if ext not in SUPPORTED_EXTS:
+        raise ValueError("Unsupported file")
+
+    if ext == "pdf" and (executor is not None or workers > 1):
+        units = _iter_pdf_parallel(path, workers, executor)
+    else:
+        units = _iter_units(path, ext)
+
+    if ext == "docx":
+        yield from _group_paragraphs(units)
+    else:
+        yield from units
+
+def load_file_pages(
+    path: str,
+    workers: int = 1,
+    executor: Optional[Executor] = None
+) -> List[str]:
+    return list(iter_file_pages(path, workers, executor))
+
 def chunk_page(text, size=800, overlap=200):
     words = text.split()
     chunks, i = [], 0
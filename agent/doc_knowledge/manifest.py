@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+from typing import Optional
+from qdrant_client.models import PointStruct, PointIdsList
+
+from doc_knowledge.config import CLIENT, MANIFEST_PATH, QDRANT_URL
+
+
+# =========================
+# HASHING
+# =========================
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# =========================
+# MANIFEST (per collection)
+# =========================
+def load_manifest(collection_name: str) -> Optional[dict]:
+    if QDRANT_URL:
+        return _load_point(collection_name)
+    return _load_file(collection_name)
+
+
+def manifest_version(collection_name: str) -> Optional[int]:
+    # Version đổi mỗi lần collection được index lại
+    if QDRANT_URL:
+        payload = _manifest_payload(collection_name)
+        return payload.get("version") if payload else None
+    return _file_version(collection_name)
+
+
+def save_manifest(collection_name: str, manifest: dict):
+    if QDRANT_URL:
+        _save_point(collection_name, manifest)
+    else:
+        _save_file(collection_name, manifest)
+
+
+def delete_manifest(collection_name: str):
+    if QDRANT_URL:
+        _delete_point(collection_name)
+    else:
+        _delete_file(collection_name)
+
+
+# =========================
+# LOCAL MODE: FILE JSON
+# =========================
+def _manifest_file(collection_name: str) -> str:
+    return os.path.join(MANIFEST_PATH, f"{collection_name}.json")
+
+
+def _load_file(collection_name: str) -> Optional[dict]:
+    path = _manifest_file(collection_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Manifest error in {collection_name}: {e}")
+        return None
+
+
+def _file_version(collection_name: str) -> Optional[int]:
+    # Version = mtime của manifest
+    try:
+        return os.stat(_manifest_file(collection_name)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _save_file(collection_name: str, manifest: dict):
+    path = _manifest_file(collection_name)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def _delete_file(collection_name: str):
+    path = _manifest_file(collection_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# =========================
+# SERVER MODE: POINT TRONG COLLECTION
+# =========================
+# Point id cố định, payload type="manifest" nên không lẫn vào search
+# (search / fetch page luôn lọc theo type chunk / page). Xóa collection
+# (index lại toàn bộ) cũng xóa luôn manifest
+MANIFEST_POINT_ID = str(uuid.uuid5(uuid.NAMESPACE_URL, "deepdoc/manifest"))
+
+
+def _manifest_payload(collection_name: str) -> Optional[dict]:
+    try:
+        points = CLIENT.retrieve(
+            collection_name=collection_name,
+            ids=[MANIFEST_POINT_ID],
+            with_payload=True,
+            with_vectors=False
+        )
+    except Exception:
+        return None
+    return points[0].payload if points else None
+
+
+def _load_point(collection_name: str) -> Optional[dict]:
+    payload = _manifest_payload(collection_name)
+    return payload.get("manifest") if payload else None
+
+
+def _save_point(collection_name: str, manifest: dict):
+    # Vector không dùng để search, chỉ cần đúng số chiều của collection
+    dim = CLIENT.get_collection(collection_name).config.params.vectors.size
+    vector = [0.0] * dim
+    vector[0] = 1.0
+    CLIENT.upsert(
+        collection_name=collection_name,
+        points=[PointStruct(
+            id=MANIFEST_POINT_ID,
+            vector=vector,
+            payload={
+                "type": "manifest",
+                "version": time.time_ns(),
+                "manifest": manifest
+            }
+        )]
+    )
+
+
+def _delete_point(collection_name: str):
+    try:
+        CLIENT.delete(
+            collection_name=collection_name,
+            points_selector=PointIdsList(points=[MANIFEST_POINT_ID])
+        )
+    except Exception:
+        pass
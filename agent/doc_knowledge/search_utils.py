@@ -1,8 +1,64 @@
 import torch, gc
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from qdrant_client.models import Filter, FieldCondition, MatchValue
+from qdrant_client.models import Filter, FieldCondition, MatchValue, MatchAny
 from doc_knowledge.entities import extract_entities, highlight_markdown
-from doc_knowledge.config import embed_model, rank_model, device, CLIENT
+from doc_knowledge.config import (
+    get_embed_model, get_rank_model, device, CLIENT,
+    SEARCH_WORKERS, RERANK_BATCH_SIZE, RERANK_CACHE_SIZE,
+    QUERY_CACHE_SIZE, ENTITY_CACHE_SIZE, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, HIGHLIGHT_NER_MAX_CHARS
+)
+from doc_knowledge.cache import LRUCache
+from doc_knowledge.manifest import hash_text, manifest_version
+from doc_knowledge.storage import collection_storage, query_vector, search_params
+from tracing import span, in_context
+from metrics import CACHE_LOOKUPS
+
+# Pool dùng chung để search nhiều collection cùng lúc
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+
+# (query, hash page text) -> rerank score, dùng lại giữa các request
+_RERANK_CACHE = LRUCache(maxsize=RERANK_CACHE_SIZE)
+
+# hash page text -> entities, cho collection cũ chưa lưu entities lúc ingest
+_ENTITY_CACHE = LRUCache(maxsize=ENTITY_CACHE_SIZE)
+
+# question đã chuẩn hóa -> embedding
+_QUERY_CACHE = LRUCache(maxsize=QUERY_CACHE_SIZE)
+
+# (question, collections, topk, versions) -> kết quả search
+_SEARCH_CACHE = LRUCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+def embed_query(query: str):
+    query = normalize_query(query)
+    q_emb = _QUERY_CACHE.get(query)
+    if q_emb is None:
+        with span("search.embed"), torch.no_grad():
+            q_emb = get_embed_model().encode(
+                [query],
+                normalize_embeddings=True
+            ).tolist()[0]
+        _QUERY_CACHE.put(query, q_emb)
+    return q_emb
+
+
+def invalidate_collection(collection_name: str):
+    # Gọi khi collection được index lại
+    _SEARCH_CACHE.invalidate(lambda key: collection_name in key[1])
+
+
+def clear_caches():
+    _RERANK_CACHE.clear()
+    _ENTITY_CACHE.clear()
+    _QUERY_CACHE.clear()
+    _SEARCH_CACHE.clear()
+
 
 class DOCSearcher:
     def __init__(
@@ -10,100 +66,173 @@ class DOCSearcher:
         collections: List[str],
         chunk_topk=10,
         page_topk=3,
-        related_topk=2
+        related_topk=2,
+        client=None
     ):
+        self.client = client or CLIENT
         self.collections = collections
         self.chunk_topk = chunk_topk
         self.page_topk = page_topk
         self.related_topk = related_topk
 
-    def _scroll_page(self, collection, pid):
-        res = CLIENT.scroll(
-            collection_name=collection,
-            scroll_filter=Filter(must=[
-                FieldCondition(key="type", match=MatchValue(value="page")),
-                FieldCondition(key="page", match=MatchValue(value=pid))
-            ]),
+    def _fetch_pages(self, collection, pids):
+        # Lấy payload của nhiều page trong 1 lần scroll
+        if not pids:
+            return {}
+        with span("search.page_fetch"):
+            points, _ = self.client.scroll(
+                collection_name=collection,
+                scroll_filter=Filter(must=[
+                    FieldCondition(key="type", match=MatchValue(value="page")),
+                    FieldCondition(key="page", match=MatchAny(any=list(pids)))
+                ]),
+                limit=len(pids),
+                with_payload=True
+            )
+        return {p.payload["page"]: p.payload for p in points}
+
+    def _vector_search(self, col, q_emb, point_type, limit):
+        # Mỗi collection có số chiều / quantization riêng (chọn lúc upload_file)
+        storage = collection_storage(col, self.client)
+        return self.client.search(
+            collection_name=col,
+            query_vector=query_vector(q_emb, storage),
+            query_filter=Filter(
+                must=[FieldCondition(key="type", match=MatchValue(value=point_type))]
+            ),
+            search_params=search_params(storage, self.client),
+            limit=limit,
             with_payload=True
         )
-        return res[0][0].payload.get("text", "") if res[0] else ""
 
-    def _rerank(self, query, items: dict, topk: int):
+    def _search_collection(self, col, q_emb):
+        try:
+            with span("search.chunk_search"):
+                chunks = self._vector_search(col, q_emb, "chunk", self.chunk_topk)
+
+            page_ids = {
+                p.payload["page"]
+                for p in chunks
+                if p.payload.get("text")
+            }
+
+            return {
+                pid: payload
+                for pid, payload in self._fetch_pages(col, page_ids).items()
+                if payload.get("text")
+            }
+
+        except Exception as e:
+            print(f"Search error in {col}: {e}")
+            return {}
+
+    def _highlight(self, text, entities):
+        # Collection cũ chưa có entities trong payload → trích xuất lúc query
+        # (giới hạn độ dài + cache theo hash để không chạy NER lại mỗi request)
+        if entities is None:
+            key = hash_text(text)
+            entities = _ENTITY_CACHE.get(key)
+            if entities is None:
+                with span("search.ner"):
+                    entities = extract_entities(text[:HIGHLIGHT_NER_MAX_CHARS])
+                _ENTITY_CACHE.put(key, entities)
+        with span("search.highlight"):
+            return highlight_markdown(text, entities)
+
+    def _rerank(self, query, items: dict, topk: int, scores: dict):
         if not items:
             return []
-        pairs = [(query, t) for t in items.values()]
-        scores = rank_model.predict(pairs, batch_size=4)
+
+        # scores: cache theo query, mỗi (collection, page) chỉ chấm điểm 1 lần
+        todo = []
+        for key, text in items.items():
+            if key in scores:
+                continue
+            cached = _RERANK_CACHE.get((query, hash_text(text)))
+            if cached is None:
+                todo.append(key)
+            else:
+                scores[key] = cached
+
+        if todo:
+            pairs = [(query, items[key]) for key in todo]
+            with span("search.rerank"):
+                preds = get_rank_model().predict(
+                    pairs,
+                    batch_size=min(RERANK_BATCH_SIZE, len(pairs))
+                )
+            for key, score in zip(todo, preds):
+                scores[key] = float(score)
+                _RERANK_CACHE.put((query, hash_text(items[key])), float(score))
+
         ranked = sorted(
-            zip(items.keys(), scores),
+            ((key, scores[key]) for key in items),
             key=lambda x: x[1],
             reverse=True
         )
         return ranked[:topk]
 
     def search(self, query: str):
-        # ===== 1. Embed query 1 lần =====
-        with torch.no_grad():
-            q_emb = embed_model.encode(
-                [query],
-                normalize_embeddings=True
-            ).tolist()[0]
-
-        global_pages = {}   # (collection, page_id) -> text
+        query = normalize_query(query)
 
-        # ===== 2. Search CHUNK trên từng collection =====
-        for col in self.collections:
-            try:
-                chunks = CLIENT.search(
-                    collection_name=col,
-                    query_vector=q_emb,
-                    query_filter=Filter(
-                        must=[FieldCondition(key="type", match=MatchValue(value="chunk"))]
-                    ),
-                    limit=self.chunk_topk,
-                    with_payload=True
-                )
-
-                page_ids = {
-                    p.payload["page"]
-                    for p in chunks
-                    if p.payload.get("text")
-                }
+        # ===== 0. Cache kết quả (tự hết hạn khi collection đổi version) =====
+        cache_key = (
+            query,
+            tuple(self.collections),
+            (self.chunk_topk, self.page_topk, self.related_topk),
+            tuple(manifest_version(col) for col in self.collections)
+        )
+        cached = _SEARCH_CACHE.get(cache_key)
+        CACHE_LOOKUPS.inc(cache="search", result="miss" if cached is None else "hit")
+        if cached is not None:
+            # Trả bản sao để caller sửa kết quả không làm hỏng cache
+            return deepcopy(cached)
 
-                for pid in page_ids:
-                    text = self._scroll_page(col, pid)
-                    if text:
-                        global_pages[(col, pid)] = text
+        # ===== 1. Embed query 1 lần =====
+        q_emb = embed_query(query)
 
-            except Exception as e:
-                print(f"Search error in {col}: {e}")
+        # ===== 2. Search CHUNK song song trên các collection =====
+        global_pages = {}   # (collection, page_id) -> text
+        page_entities = {}  # (collection, page_id) -> entities lưu sẵn lúc ingest
+        for col, pages in zip(
+            self.collections,
+            _SEARCH_POOL.map(
+                in_context(lambda c: self._search_collection(c, q_emb)),
+                self.collections
+            )
+        ):
+            for pid, payload in pages.items():
+                global_pages[(col, pid)] = payload["text"]
+                page_entities[(col, pid)] = payload.get("entities")
 
         # ===== 3. Rerank PAGE TOÀN CỤC =====
-        ranked_pages = self._rerank(query, global_pages, self.page_topk)
+        scores = {}
+        ranked_pages = self._rerank(query, global_pages, self.page_topk, scores)
 
         outputs = []
 
         for rank, ((col, pid), score) in enumerate(ranked_pages, start=1):
-            text = global_pages[(col, pid)]
-            highlight = highlight_markdown(text, extract_entities(text))
+            highlight = self._highlight(
+                global_pages[(col, pid)],
+                page_entities[(col, pid)]
+            )
 
             # ===== related pages cùng collection =====
-            candidates = CLIENT.search(
-                collection_name=col,
-                query_vector=q_emb,
-                query_filter=Filter(
-                    must=[FieldCondition(key="type", match=MatchValue(value="page"))]
-                ),
-                limit=10,
-                with_payload=True
-            )
+            with span("search.related_search"):
+                candidates = self._vector_search(col, q_emb, "page", 10)
 
             related = {
                 (col, p.payload["page"]): p.payload.get("text", "")
                 for p in candidates
                 if p.payload["page"] != pid
             }
+            related_entities = {
+                (col, p.payload["page"]): p.payload.get("entities")
+                for p in candidates
+                if p.payload["page"] != pid
+            }
 
-            ranked_related = self._rerank(query, related, self.related_topk)
+            ranked_related = self._rerank(query, related, self.related_topk, scores)
 
             outputs.append({
                 "rank": rank,
@@ -117,9 +246,9 @@ class DOCSearcher:
                         "collection": r_col,
                         "page": r_pid + 1,
                         "score": round(float(r_score), 4),
-                        "highlighted_text": highlight_markdown(
+                        "highlighted_text": self._highlight(
                             related[(r_col, r_pid)],
-                            extract_entities(related[(r_col, r_pid)])
+                            related_entities[(r_col, r_pid)]
                         )
                     }
                     for r_rank, ((r_col, r_pid), r_score)
@@ -127,8 +256,10 @@ class DOCSearcher:
                 ]
             })
 
-        gc.collect()
-        if device == "cuda":
-            torch.cuda.empty_cache()
+        with span("search.gc"):
+            gc.collect()
+            if device == "cuda":
+                torch.cuda.empty_cache()
 
+        _SEARCH_CACHE.put(cache_key, deepcopy(outputs))
         return outputs
@@ -0,0 +1,170 @@
+from dataclasses import asdict, dataclass, fields
+from typing import List, Optional
+
+import numpy as np
+from qdrant_client.local.qdrant_local import QdrantLocal
+from qdrant_client.models import (
+    Distance, VectorParams, HnswConfigDiff, SearchParams, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig
+)
+
+from doc_knowledge.config import (
+    CLIENT, EMBED_DIM, STORAGE_DIM, STORAGE_QUANTIZATION, STORAGE_ON_DISK,
+    HNSW_M, HNSW_EF_CONSTRUCT, SEARCH_HNSW_EF, QUANTIZATION_OVERSAMPLING
+)
+from doc_knowledge.cache import LRUCache
+from doc_knowledge.manifest import load_manifest, manifest_version
+
+QUANTIZATIONS = (None, "scalar", "binary")
+
+
+# =========================
+# STORAGE CONFIG (PER COLLECTION)
+# =========================
+# Mặc định = cách lưu cũ (1024 chiều float32, HNSW trong RAM), dùng cho
+# collection index trước khi có tuỳ chọn này
+@dataclass
+class StorageConfig:
+    dim: int = EMBED_DIM
+    quantization: Optional[str] = None
+    on_disk: bool = False
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+
+    def __post_init__(self):
+        if not 0 < self.dim <= EMBED_DIM:
+            raise ValueError(f"dim must be in 1..{EMBED_DIM}, got {self.dim}")
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(
+                f"quantization must be one of {QUANTIZATIONS}, got {self.quantization!r}"
+            )
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "StorageConfig":
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in names})
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def default_storage() -> StorageConfig:
+    # Cấu hình cho collection mới khi upload_file không chỉ định
+    return StorageConfig(
+        dim=STORAGE_DIM,
+        quantization=STORAGE_QUANTIZATION,
+        on_disk=STORAGE_ON_DISK,
+        hnsw_m=HNSW_M,
+        hnsw_ef_construct=HNSW_EF_CONSTRUCT
+    )
+
+
+# =========================
+# LOCAL MODE
+# =========================
+def is_local(client=None) -> bool:
+    # QdrantClient(path=...) search brute-force trên vector float32:
+    # không có HNSW, quantization, on_disk, bỏ qua SearchParams
+    return isinstance(getattr(client or CLIENT, "_client", None), QdrantLocal)
+
+
+def effective_storage(storage: StorageConfig, client=None, warn: bool = True) -> StorageConfig:
+    # Phần cấu hình thật sự có tác dụng với client; chỉ phần này được lưu vào
+    # manifest và so sánh để quyết định index lại
+    if not is_local(client):
+        return storage
+    local = StorageConfig(dim=storage.dim)
+    if warn and local != storage:
+        print(
+            "Qdrant local mode chỉ hỗ trợ dim, bỏ qua quantization / on_disk / HNSW "
+            "(cần DEEPDOC_QDRANT_URL)"
+        )
+    return local
+
+
+# =========================
+# QDRANT PARAMS
+# =========================
+def vectors_config(storage: StorageConfig) -> VectorParams:
+    return VectorParams(
+        size=storage.dim,
+        distance=Distance.COSINE,
+        on_disk=storage.on_disk
+    )
+
+
+def hnsw_config(storage: StorageConfig) -> HnswConfigDiff:
+    return HnswConfigDiff(
+        m=storage.hnsw_m,
+        ef_construct=storage.hnsw_ef_construct,
+        on_disk=storage.on_disk
+    )
+
+
+def quantization_config(storage: StorageConfig):
+    # Vector quantized luôn giữ trong RAM để search nhanh, vector gốc dùng để rescore
+    if storage.quantization == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if storage.quantization == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def search_params(storage: StorageConfig, client=None) -> Optional[SearchParams]:
+    if is_local(client):
+        return None
+    quantization = None
+    if storage.quantization:
+        quantization = QuantizationSearchParams(
+            rescore=True,
+            oversampling=QUANTIZATION_OVERSAMPLING
+        )
+    return SearchParams(hnsw_ef=SEARCH_HNSW_EF, quantization=quantization)
+
+
+# =========================
+# MATRYOSHKA TRUNCATION
+# =========================
+def truncate(embs: np.ndarray, dim: int) -> np.ndarray:
+    # Giữ dim chiều đầu rồi chuẩn hóa lại (cosine)
+    embs = np.asarray(embs, dtype=np.float32)
+    if embs.shape[-1] == dim:
+        return embs
+    embs = embs[..., :dim]
+    norms = np.linalg.norm(embs, axis=-1, keepdims=True)
+    return embs / np.maximum(norms, 1e-12)
+
+
+def query_vector(q_emb: List[float], storage: StorageConfig) -> List[float]:
+    if len(q_emb) == storage.dim:
+        return q_emb
+    return truncate(q_emb, storage.dim).tolist()
+
+
+# =========================
+# STORAGE CỦA COLLECTION ĐÃ INDEX
+# =========================
+# (collection, version manifest) -> StorageConfig
+_STORAGE_CACHE = LRUCache(maxsize=1024)
+
+
+def collection_storage(collection_name: str, client=None) -> StorageConfig:
+    version = manifest_version(collection_name)
+    if version is None:
+        # Chưa có manifest (đang index lần đầu) → đọc số chiều từ collection
+        try:
+            info = (client or CLIENT).get_collection(collection_name)
+            return StorageConfig(dim=info.config.params.vectors.size)
+        except Exception:
+            return StorageConfig()
+
+    key = (collection_name, version)
+    storage = _STORAGE_CACHE.get(key)
+    if storage is None:
+        manifest = load_manifest(collection_name) or {}
+        storage = StorageConfig.from_dict(manifest.get("storage"))
+        _STORAGE_CACHE.put(key, storage)
+    return storage
@@ -1,50 +1,249 @@
 import os
 import uuid
+import threading
 import torch
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import (
+    PointStruct, Filter, FieldCondition, MatchAny, FilterSelector
+)
 
-from doc_knowledge.config import CLIENT, embed_model
-from doc_knowledge.file_loader import load_file_pages, chunk_page
+from doc_knowledge.config import (
+    CLIENT, get_embed_model,
+    EMBED_BATCH_SIZE, UPSERT_BATCH_SIZE, INGEST_WINDOW_PAGES, INGEST_PARSE_WORKERS
+)
+from doc_knowledge.entities import extract_entities_batch
+from doc_knowledge.file_loader import iter_file_pages, chunk_page
+from doc_knowledge.search_utils import invalidate_collection
+from tracing import span, timed_iter
+from doc_knowledge.manifest import hash_file, hash_text, load_manifest, save_manifest
+from doc_knowledge.storage import (
+    StorageConfig, default_storage, effective_storage, truncate,
+    vectors_config, hnsw_config, quantization_config
+)
+
+
+# =========================
+# LOCK THEO COLLECTION
+# =========================
+# Mọi lần ghi 1 collection (job ingest nền, hoặc query gặp file chưa index)
+# đi qua cùng 1 lock: 2 writer song song sẽ xóa collection của nhau
+# (_recreate_collection) hoặc upsert trùng page với point id khác nhau
+_collection_locks: Dict[str, threading.Lock] = {}
+_collection_locks_guard = threading.Lock()
+
+
+def collection_lock(collection_name: str) -> threading.Lock:
+    with _collection_locks_guard:
+        return _collection_locks.setdefault(collection_name, threading.Lock())
+
+
+def is_indexing(collection_name: str) -> bool:
+    return collection_lock(collection_name).locked()
 
 
 class QdrantFileUploader:
-    def __init__(self, client: QdrantClient = CLIENT, embed_model=embed_model):
+    def __init__(self, client: QdrantClient = CLIENT, embed_model=None):
         self.client = client
-        self.embed_model = embed_model
+        self._embed_model = embed_model
+
+    @property
+    def embed_model(self):
+        # Load embed model khi cần encode lần đầu
+        if self._embed_model is None:
+            self._embed_model = get_embed_model()
+        return self._embed_model
 
-    def upload_file(self, file_path: str) -> str:
+    def is_up_to_date(self, file_path: str, storage: Optional[StorageConfig] = None) -> bool:
+        collection_name = f"doc_{os.path.basename(file_path)}"
+        if not self._collection_exists(collection_name):
+            return False
+        manifest = load_manifest(collection_name)
+        if not manifest or manifest.get("file_hash") != hash_file(file_path):
+            return False
+        if storage is None:
+            return True
+        stored = StorageConfig.from_dict(manifest.get("storage"))
+        return (
+            effective_storage(stored, self.client, warn=False)
+            == effective_storage(storage, self.client, warn=False)
+        )
+
+    def upload_file(
+        self,
+        file_path: str,
+        pages: Optional[Iterable[str]] = None,
+        on_progress: Optional[Callable[[int], None]] = None,
+        storage: Optional[StorageConfig] = None
+    ) -> str:
+        # Writer thứ 2 chờ writer đầu xong; file không đổi → bỏ qua nhờ manifest
+        with collection_lock(f"doc_{os.path.basename(file_path)}"):
+            return self._upload_file(file_path, pages, on_progress, storage)
+
+    def _upload_file(
+        self,
+        file_path: str,
+        pages: Optional[Iterable[str]],
+        on_progress: Optional[Callable[[int], None]],
+        storage: Optional[StorageConfig]
+    ) -> str:
         file_name = os.path.basename(file_path)
         collection_name = f"doc_{file_name}"
 
-        pages = load_file_pages(file_path)
+        file_hash = hash_file(file_path)
+        manifest = None
+        if self._collection_exists(collection_name):
+            manifest = load_manifest(collection_name)
+
+        # Không chỉ định storage → giữ cách lưu hiện tại của collection
+        # (chỉ phần có tác dụng với client, vd. local mode chỉ có dim)
+        stored = None
+        if manifest:
+            stored = effective_storage(
+                StorageConfig.from_dict(manifest.get("storage")), self.client, warn=False
+            )
+        storage = effective_storage(storage or stored or default_storage(), self.client)
+
+        if stored is not None and stored != storage:
+            # Đổi số chiều / quantization → phải index lại toàn bộ
+            print(f"Storage của '{collection_name}' thay đổi, index lại toàn bộ")
+            manifest = None
+
+        # File không đổi → bỏ qua
+        if manifest and manifest.get("file_hash") == file_hash:
+            print(f"File '{file_name}' không thay đổi, bỏ qua upload")
+            return collection_name
+
+        # Cho phép truyền page đã parse sẵn (vd. từ process pool)
+        if pages is None:
+            pages = timed_iter(
+                iter_file_pages(file_path, workers=INGEST_PARSE_WORKERS),
+                "ingest.parse"
+            )
+
+        if manifest is None:
+            # Không có manifest → xóa (nếu có) và tạo mới
+            self._recreate_collection(collection_name, storage)
+            old_hashes = []
+        else:
+            old_hashes = manifest.get("pages", [])
+
+        # Stream page → chỉ giữ tối đa INGEST_WINDOW_PAGES page trong bộ nhớ
+        page_hashes, window, changed = [], [], 0
+        for pid, text in enumerate(pages):
+            page_hash = hash_text(text)
+            page_hashes.append(page_hash)
+            if on_progress:
+                on_progress(len(page_hashes))
+            if pid < len(old_hashes) and old_hashes[pid] == page_hash:
+                continue
+
+            window.append((pid, text, page_hash))
+            if len(window) >= INGEST_WINDOW_PAGES:
+                self._replace_pages(collection_name, window, len(old_hashes), storage.dim)
+                changed += len(window)
+                window = []
+
+        if window:
+            self._replace_pages(collection_name, window, len(old_hashes), storage.dim)
+            changed += len(window)
+
+        # Xóa point của page đã bị xóa
+        removed = list(range(len(page_hashes), len(old_hashes)))
+        if removed:
+            self._delete_pages(collection_name, removed)
+
+        save_manifest(collection_name, {
+            "file_hash": file_hash,
+            "pages": page_hashes,
+            "storage": storage.to_dict()
+        })
+        invalidate_collection(collection_name)
+        print(
+            f"Đã upload file '{file_name}' thành công "
+            f"({changed} page mới/sửa, {len(removed)} page bị xóa)"
+        )
+        return collection_name
 
-        # Nếu collection tồn tại → xóa để tạo mới
+    def _collection_exists(self, collection_name: str) -> bool:
         try:
             self.client.get_collection(collection_name)
+            return True
+        except Exception:
+            return False
+
+    def _recreate_collection(self, collection_name: str, storage: StorageConfig):
+        if self._collection_exists(collection_name):
             self.client.delete_collection(collection_name)
             print(f"Collection '{collection_name}' đã tồn tại, xóa và tạo mới...")
-        except:
-            pass
 
-        # Tạo collection
         self.client.create_collection(
             collection_name=collection_name,
-            vectors_config=VectorParams(
-                size=1024,
-                distance=Distance.COSINE
+            vectors_config=vectors_config(storage),
+            hnsw_config=hnsw_config(storage),
+            quantization_config=quantization_config(storage),
+            on_disk_payload=storage.on_disk
+        )
+
+    def _replace_pages(
+        self,
+        collection_name: str,
+        pages: List[Tuple[int, str, str]],
+        old_count: int,
+        dim: int
+    ):
+        # Xóa point cũ của page đã sửa rồi index lại
+        stale = [pid for pid, _, _ in pages if pid < old_count]
+        if stale:
+            self._delete_pages(collection_name, stale)
+        self._index_pages(collection_name, pages, dim)
+
+    def _delete_pages(self, collection_name: str, page_ids: List[int]):
+        # Xóa cả point page và chunk của các page
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=FilterSelector(
+                filter=Filter(must=[
+                    FieldCondition(key="page", match=MatchAny(any=page_ids))
+                ])
             )
         )
 
-        # ================= PAGE LEVEL =================
-        with torch.no_grad():
-            page_embs = self.embed_model.encode(
-                pages,
+    def _encode(self, texts: List[str], dim: int) -> List[List[float]]:
+        # Sắp xếp theo độ dài để mỗi batch ít padding, rồi trả về đúng thứ tự
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        with span("ingest.embed"), torch.no_grad():
+            embs = self.embed_model.encode(
+                [texts[i] for i in order],
+                batch_size=EMBED_BATCH_SIZE,
                 normalize_embeddings=True
-            ).tolist()
+            )
+            # Matryoshka: giữ dim chiều đầu, chuẩn hóa lại
+            embs = truncate(embs, dim).tolist()
+
+        result = [None] * len(texts)
+        for i, emb in zip(order, embs):
+            result[i] = emb
+        return result
+
+    def _upsert(self, collection_name: str, points: List[PointStruct]):
+        for i in range(0, len(points), UPSERT_BATCH_SIZE):
+            with span("ingest.upsert"):
+                self.client.upsert(
+                    collection_name=collection_name,
+                    points=points[i:i + UPSERT_BATCH_SIZE]
+                )
+
+    def _index_pages(self, collection_name: str, pages: List[Tuple[int, str, str]], dim: int):
+        # ================= PAGE LEVEL =================
+        page_embs = self._encode([text for _, text, _ in pages], dim)
+
+        # Trích xuất entity lúc ingest để search không phải chạy NER
+        with span("ingest.ner"):
+            page_entities = extract_entities_batch([text for _, text, _ in pages])
 
         page_points = []
-        for i, (text, emb) in enumerate(zip(pages, page_embs)):
+        for (pid, text, page_hash), emb, entities in zip(pages, page_embs, page_entities):
             page_points.append(
                 PointStruct(
                     id=str(uuid.uuid4()),
@@ -52,47 +251,43 @@ class QdrantFileUploader:
                     payload={
                         "text": text,
                         "type": "page",
-                        "page": i,
-                        "original_index": i
+                        "page": pid,
+                        "original_index": pid,
+                        "hash": page_hash,
+                        "entities": entities
                     }
                 )
             )
-
-        self.client.upsert(
-            collection_name=collection_name,
-            points=page_points
-        )
+        self._upsert(collection_name, page_points)
 
         # ================= CHUNK LEVEL =================
-        chunk_points = []
-        for pid, text in enumerate(pages):
-            chunks = chunk_page(text)
-            if not chunks:
-                continue
+        # Gom chunk của tất cả page rồi encode một lần
+        chunk_meta, chunk_texts = [], []
+        for pid, text, _ in pages:
+            for chunk_id, chunk_text in enumerate(chunk_page(text)):
+                chunk_meta.append((pid, chunk_id))
+                chunk_texts.append(chunk_text)
 
-            with torch.no_grad():
-                embs = self.embed_model.encode(chunks).tolist()
-
-            for chunk_id, (chunk_text, chunk_emb) in enumerate(zip(chunks, embs)):
-                chunk_points.append(
-                    PointStruct(
-                        id=str(uuid.uuid4()),
-                        vector=chunk_emb,
-                        payload={
-                            "text": chunk_text,
-                            "type": "chunk",
-                            "page": pid,
-                            "chunk_id": chunk_id
-                        }
-                    )
-                )
-        if chunk_points:
-            self.client.upsert(
-                collection_name=collection_name,
-                points=chunk_points
+        if not chunk_texts:
+            return
+
+        chunk_embs = self._encode(chunk_texts, dim)
+
+        chunk_points = [
+            PointStruct(
+                id=str(uuid.uuid4()),
+                vector=chunk_emb,
+                payload={
+                    "text": chunk_text,
+                    "type": "chunk",
+                    "page": pid,
+                    "chunk_id": chunk_id
+                }
             )
-        print(f"Đã upload file '{file_name}' thành công")
-        return collection_name
+            for (pid, chunk_id), chunk_text, chunk_emb
+            in zip(chunk_meta, chunk_texts, chunk_embs)
+        ]
+        self._upsert(collection_name, chunk_points)
 
     def list_collections(self):
         try:
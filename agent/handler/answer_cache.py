@@ -0,0 +1,61 @@
+import os
+from typing import Iterator, List, Optional
+
+from doc_knowledge.cache import SemanticCache
+from doc_knowledge.config import (
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL
+)
+from doc_knowledge.manifest import manifest_version
+from doc_knowledge.search_utils import embed_query, normalize_query
+from metrics import CACHE_LOOKUPS
+
+_ANSWER_CACHE = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    maxsize=SEMANTIC_CACHE_SIZE,
+    ttl=SEMANTIC_CACHE_TTL
+)
+
+
+def _scope(file_names: List[str]):
+    # Câu trả lời chỉ dùng lại cho đúng tập file và đúng version đã index
+    collections = sorted(f"doc_{os.path.basename(name)}" for name in file_names)
+    return tuple((col, manifest_version(col)) for col in collections)
+
+
+def lookup_answer(question: str, file_names: List[str]) -> Optional[str]:
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    cached = _ANSWER_CACHE.lookup(_scope(file_names), embed_query(question))
+    CACHE_LOOKUPS.inc(cache="answer", result="miss" if cached is None else "hit")
+    return cached
+
+
+def stream_cached(text: str) -> Iterator[str]:
+    for token in text.split(" "):
+        yield token + " "
+
+
+def record_answer(
+    question: str,
+    file_names: List[str],
+    stream: Iterator[str]
+) -> Iterator[str]:
+    if not SEMANTIC_CACHE_ENABLED:
+        yield from stream
+        return
+
+    parts = []
+    for token in stream:
+        parts.append(token)
+        yield token
+
+    # Chỉ lưu khi stream chạy hết (client không ngắt giữa chừng)
+    text = "".join(parts).strip()
+    if text:
+        _ANSWER_CACHE.store(
+            _scope(file_names),
+            normalize_query(question),
+            embed_query(question),
+            text
+        )
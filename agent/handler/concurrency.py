@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from metrics import Counter, Gauge
+
+REJECTED = Counter(
+    "deepdoc_rejected_total",
+    "Requests rejected with 429 by executor",
+    ["executor"]
+)
+
+
+class Overloaded(RuntimeError):
+    def __init__(self, message: str, depth: Optional[int] = None):
+        super().__init__(message)
+        self.depth = depth
+
+
+# =========================
+# EXECUTOR GIỚI HẠN (BACKPRESSURE)
+# =========================
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, max_pending: int):
+        # Tối đa `workers` việc chạy cùng lúc, `max_pending` việc chờ + chạy;
+        # quá giới hạn → Overloaded (429) thay vì xếp hàng vô hạn
+        self.name = name
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        Gauge(
+            f"deepdoc_{name}_pending",
+            f"Pending + running tasks on the {name} executor",
+            fn=self.pending
+        )
+
+    def pending(self) -> int:
+        return self._pending
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                REJECTED.inc(executor=self.name)
+                raise Overloaded(f"{self.name} queue is full", self._pending)
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        self._acquire()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Trả slot khi thread thật sự chạy xong, kể cả khi request async bị hủy
+        # giữa chừng (thread vẫn đang chạy fn)
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
@@ -0,0 +1,155 @@
+import math
+import re
+from typing import List, Optional, Tuple
+
+from llm.config import ContextConfig
+from llm.generate import get_tokenizer
+
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer()(text, add_special_tokens=False)["input_ids"])
+
+
+# =========================
+# TRIM PAGE BY RELEVANCE
+# =========================
+def _segments(text: str, max_words: int = 64) -> List[str]:
+    # Tách theo dòng, dòng quá dài thì cắt theo cụm từ
+    segs = []
+    for line in text.split("\n"):
+        words = line.split()
+        if not words:
+            continue
+        for i in range(0, len(words), max_words):
+            segs.append(" ".join(words[i:i + max_words]))
+    return segs
+
+
+def _terms(text: str) -> set:
+    return {w for w in re.findall(r"\w+", text.lower()) if len(w) > 1}
+
+
+def trim_to_budget(text: Optional[str], query: str, budget: int) -> str:
+    if not text or budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+
+    segs = _segments(text)
+    lengths = [
+        len(ids)
+        for ids in get_tokenizer()(segs, add_special_tokens=False)["input_ids"]
+    ]
+    q_terms = _terms(query)
+
+    # Điểm = số từ trùng với câu hỏi, chuẩn hóa theo độ dài đoạn
+    scores = [
+        len(q_terms & _terms(seg)) / math.sqrt(n or 1)
+        for seg, n in zip(segs, lengths)
+    ]
+
+    # Giữ đoạn điểm cao nhất cho tới khi hết budget, rồi trả về đúng thứ tự gốc
+    keep, used = set(), 0
+    for i in sorted(range(len(segs)), key=lambda i: scores[i], reverse=True):
+        if used + lengths[i] <= budget:
+            keep.add(i)
+            used += lengths[i]
+
+    return "\n".join(segs[i] for i in sorted(keep))
+
+
+def _pack_parts(segs: List[str], lengths: List[int], budget: int) -> List[str]:
+    parts, buf, used = [], [], 0
+    for seg, n in zip(segs, lengths):
+        if buf and used + n > budget:
+            parts.append("\n".join(buf))
+            buf, used = [], 0
+        buf.append(seg)
+        used += n
+    if buf:
+        parts.append("\n".join(buf))
+    return parts
+
+
+def _segment_lengths(segs: List[str]) -> List[int]:
+    return [
+        len(ids)
+        for ids in get_tokenizer()(segs, add_special_tokens=False)["input_ids"]
+    ]
+
+
+def split_to_budget(
+    text: Optional[str],
+    budget: int,
+    query: str = "",
+    max_parts: Optional[int] = None
+) -> List[str]:
+    # Cắt text thành các phần liên tiếp (theo dòng / cụm từ), mỗi phần <= budget
+    if not text or count_tokens(text) <= budget:
+        return [text or ""]
+
+    segs = _segments(text)
+    lengths = _segment_lengths(segs)
+    parts = _pack_parts(segs, lengths, budget)
+    if max_parts is None or len(parts) <= max_parts:
+        return parts
+
+    # Quá max_parts → giữ các đoạn liên quan nhất. Mỗi phần (trừ phần cuối)
+    # hụt budget ít hơn 1 đoạn, nên trim còn max_parts * (budget - đoạn dài nhất)
+    # thì chắc chắn vừa max_parts phần
+    text = trim_to_budget(text, query, max_parts * (budget - max(lengths)))
+    segs = _segments(text)
+    return _pack_parts(segs, _segment_lengths(segs), budget)
+
+
+# =========================
+# CONTEXT PACKER
+# =========================
+def doc_budget(query: str, instruction_tokens: int, config: ContextConfig = ContextConfig()) -> int:
+    # Budget cho tài liệu = budget prompt - instruction - câu hỏi
+    return max(config.prompt_budget - instruction_tokens - count_tokens(query), 0)
+
+
+def _pack(
+    query: str,
+    main_page_text: Optional[str],
+    related_pages: List[Optional[str]],
+    budget: int,
+    main_budget: int
+) -> Tuple[str, List[str]]:
+    main = trim_to_budget(main_page_text, query, main_budget)
+
+    # Phần main page không dùng hết được chia cho related pages
+    related_budget = budget - count_tokens(main)
+    related = [text for text in related_pages if text]
+    per_page = related_budget // len(related) if related else 0
+    related = [trim_to_budget(text, query, per_page) for text in related]
+
+    return main, related
+
+
+def pack_summary_context(
+    query: str,
+    main_page_text: Optional[str],
+    related_pages: List[Optional[str]],
+    instruction_tokens: int,
+    config: ContextConfig = ContextConfig()
+) -> Tuple[str, List[str]]:
+    # Summary 1 page (map-reduce): main page tối đa main_page_share budget
+    budget = doc_budget(query, instruction_tokens, config)
+    return _pack(
+        query, main_page_text, related_pages, budget,
+        int(budget * config.main_page_share)
+    )
+
+
+def pack_single_context(
+    query: str,
+    main_page_text: Optional[str],
+    related_pages: List[Optional[str]],
+    instruction_tokens: int,
+    config: ContextConfig = ContextConfig()
+) -> Tuple[str, List[str]]:
+    # Single pass: main pages được dùng cả budget, related lấy phần còn lại
+    budget = doc_budget(query, instruction_tokens, config)
+    return _pack(query, main_page_text, related_pages, budget, budget)
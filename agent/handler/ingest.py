@@ -0,0 +1,223 @@
+import os
+import time
+import queue
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional
+
+from doc_knowledge.config import (
+    INGEST_PARSE_WORKERS, INGEST_MAX_JOBS, INGEST_MAX_PENDING_FILES,
+    INGEST_WINDOW_PAGES, INGEST_PREFETCH_WINDOWS
+)
+from doc_knowledge.file_loader import iter_file_pages, parse_pool, shutdown_parse_pool
+from doc_knowledge.vectordb_utils import QdrantFileUploader
+from doc_knowledge.storage import StorageConfig
+from handler.concurrency import Overloaded
+from metrics import Gauge
+from tracing import count, in_context, span, timed_iter, trace
+
+_END = object()
+
+
+# =========================
+# PARSE TRƯỚC (HÀNG ĐỢI GIỚI HẠN)
+# =========================
+class _Prefetch:
+    def __init__(self, pages: Iterable[str], executor, maxsize: int):
+        # Parse chạy trên thread riêng, tối đa maxsize page chờ embed
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        executor.submit(in_context(self._produce), pages)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, pages: Iterable[str]):
+        it = iter(pages)
+        try:
+            for page in it:
+                if not self._put(page):
+                    return
+            self._put(_END)
+        except Exception as e:
+            self._put(e)
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        # Dừng parse (upload bỏ qua / lỗi) để thread không chờ hàng đợi mãi
+        self._stop.set()
+
+
+# =========================
+# INGESTION JOB QUEUE
+# =========================
+class IngestionQueue:
+    def __init__(
+        self,
+        parse_workers: int = INGEST_PARSE_WORKERS,
+        max_pending: int = INGEST_MAX_PENDING_FILES
+    ):
+        # Một uploader (và một embed model) dùng chung cho mọi job
+        self.uploader = QdrantFileUploader()
+
+        # Parse file (CPU-bound) chia theo dải page trên process pool dùng chung,
+        # embed + upsert lần lượt trên model owner
+        self._parse_pool = parse_pool(parse_workers)
+        self._workers = ThreadPoolExecutor(max_workers=parse_workers)
+        # Mỗi job có 1 thread parse trước, chạy cả khi job đang chờ embed lock
+        self._prefetch = ThreadPoolExecutor(max_workers=parse_workers)
+        self._embed_lock = threading.Lock()
+
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Số file chưa ingest xong; quá max_pending → từ chối job mới
+        self.max_pending = max_pending
+        self._pending = 0
+        Gauge(
+            "deepdoc_ingest_pending_files",
+            "Files queued or being ingested",
+            fn=self.pending
+        )
+
+    def pending(self) -> int:
+        return self._pending
+
+    def has_capacity(self, n: int = 1) -> bool:
+        return self._pending + n <= self.max_pending
+
+    def submit(self, file_paths: List[str], storage: Optional[StorageConfig] = None) -> dict:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "created_at": time.time(),
+            "files": [
+                {
+                    "file": os.path.basename(path),
+                    "collection": f"doc_{os.path.basename(path)}",
+                    "status": "queued",
+                    "pages": 0,
+                    "error": None
+                }
+                for path in file_paths
+            ]
+        }
+
+        with self._lock:
+            if self._pending + len(file_paths) > self.max_pending:
+                raise Overloaded("Ingestion queue is full", self._pending)
+            self._pending += len(file_paths)
+            self._jobs[job_id] = job
+            while len(self._jobs) > INGEST_MAX_JOBS:
+                self._jobs.popitem(last=False)
+
+        for idx, path in enumerate(file_paths):
+            self._workers.submit(self._run, job_id, idx, path, storage)
+
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return self._snapshot(job)
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            return [self._snapshot(job) for job in self._jobs.values()]
+
+    def _snapshot(self, job: dict) -> dict:
+        files = [dict(f) for f in job["files"]]
+        statuses = {f["status"] for f in files}
+        if statuses <= {"done", "failed"}:
+            status = "failed" if "failed" in statuses else "done"
+        elif statuses == {"queued"}:
+            status = "queued"
+        else:
+            status = "running"
+        return {
+            "job_id": job["job_id"],
+            "created_at": job["created_at"],
+            "status": status,
+            "files": files
+        }
+
+    def _update(self, job_id: str, idx: int, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["files"][idx].update(fields)
+
+    def _run(self, job_id: str, idx: int, file_path: str, storage: Optional[StorageConfig]):
+        try:
+            with trace("ingest"):
+                self._ingest(job_id, idx, file_path, storage)
+        except Exception as e:
+            print(f"Ingest error in {file_path}: {e}")
+            self._update(job_id, idx, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _ingest(self, job_id: str, idx: int, file_path: str, storage: Optional[StorageConfig]):
+        if self.uploader.is_up_to_date(file_path, storage):
+            self._update(job_id, idx, status="done")
+            return
+
+        # Parse bắt đầu ngay (PDF chia dải page trên process pool), giữ tối đa
+        # INGEST_PREFETCH_WINDOWS window; chỉ embed + upsert phải chờ lượt
+        pages = _Prefetch(
+            timed_iter(iter_file_pages(file_path, executor=self._parse_pool), "ingest.parse"),
+            self._prefetch,
+            INGEST_WINDOW_PAGES * INGEST_PREFETCH_WINDOWS
+        )
+        progress = [0]
+
+        def on_progress(n: int):
+            progress[0] = n
+            self._update(job_id, idx, pages=n)
+
+        try:
+            with span("ingest.wait"):
+                self._embed_lock.acquire()
+            try:
+                self._update(job_id, idx, status="indexing")
+                self.uploader.upload_file(
+                    file_path,
+                    pages=pages,
+                    on_progress=on_progress,
+                    storage=storage
+                )
+            finally:
+                self._embed_lock.release()
+        finally:
+            pages.close()
+        count("ingest.pages", progress[0])
+
+        self._update(job_id, idx, status="done")
+
+    def shutdown(self):
+        self._workers.shutdown(wait=False)
+        self._prefetch.shutdown(wait=False)
+        shutdown_parse_pool()
@@ -1,14 +1,40 @@
 from handler.retrieval import query_document
 from doc_knowledge.config import COLLECTIONS
-from llm.generate import generate_text
-from handler.summary import summary
-import threading
-from typing import List
+from llm.generate import (
+    generate_batch, generate_as_completed, generate_stream, register_prefix
+)
+from llm.config import AnswerConfig, ContextConfig, GenerationConfig
+from handler.summary import summary, SUMMARY_INSTRUCTIONS
+from handler.context import (
+    count_tokens, doc_budget, pack_summary_context, pack_single_context, split_to_budget,
+    trim_to_budget
+)
+from tracing import span
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+import logging
+import math
 
-def answer(question: str, file_names: List[str]) -> str:
+_context_cfg = ContextConfig()
+_summary_gen_cfg = GenerationConfig(max_new_tokens=_context_cfg.summary_max_new_tokens)
+
+logger = logging.getLogger(__name__)
+
+# Phần instruction cố định đặt đầu prompt để dùng lại KV cache của prefix
+SYNTHESIS_INSTRUCTIONS = """
+        You are an expert answer synthesizer and factual information integrator specialized in multi-page summarization pipelines. Your responsibility is to combine multiple PARTIAL SUMMARIES into ONE final, complete, and factually accurate answer to the QUESTION. You MUST rely exclusively on the provided summaries; external knowledge, assumptions, inference, or logical extension beyond the text are strictly forbidden. TASK: Combine and consolidate the PARTIAL SUMMARIES from multiple pages into a single coherent answer that directly addresses the QUESTION, including ONLY information explicitly stated in the summaries. STRICT RULES: (1) Language enforcement: detect the language of the QUESTION and respond ONLY in the same language; do not translate or mix languages; this overrides the summaries’ language. (2) Source confinement: use ONLY information explicitly present in the PARTIAL SUMMARIES; do not infer, assume, or extend facts; if information is missing, explicitly state it is not available. (3) Fact preservation: preserve factual details EXACTLY as written for names (people, organizations), dates and time expressions, numerical values and units, locations/place names, titles, roles, and formal designations. (4) Information merging: merge duplicated facts into a single unified statement; prefer chronological ordering when dates exist; do NOT repeat the same fact. (5) Conflict detection: if summaries conflict, explicitly identify the contradiction and specify which page provides which version; do NOT resolve or judge conflicts. (6) Completeness control: if summaries do not fully answer the QUESTION, clearly state what information is missing; do NOT speculate. (7) Relevance filter: ignore off-topic, background, or decorative content not needed to answer the QUESTION. (8) Format constraints: do NOT output source code, JSON, XML, YAML, tables, schemas, or pseudo-code; use plain text only with headings and bullet points; generate structured formats ONLY if the QUESTION explicitly requests them. (9) Fact emphasis: highlight ALL important facts using **bold markdown** and highlight factual content only. OUTPUT FORMAT (MANDATORY): Final Answer – a clear, concise, complete answer addressing the QUESTION using short paragraphs or bullet points, without restating the question or adding opinions. Key Facts Extracted – include ONLY relevant categories appearing in the summaries and omit empty ones: Dates / Time; People / Organizations; Locations; Numerical Data; Events / Decisions. Conflicts or Inconsistencies (if any) – list each contradiction and reference the specific pages involved (Page 1, Page 2, Page 3). FINAL VALIDATION: ensure output language matches the QUESTION, no facts beyond the summaries are added, no code/tables/structured data appear, and all bolded facts exist verbatim in the summaries.
+"""
+
+NO_ANSWER_MESSAGE = "The selected documents do not contain information relevant to this question."
+
+register_prefix(SUMMARY_INSTRUCTIONS)
+register_prefix(SYNTHESIS_INSTRUCTIONS)
+
+def _retrieve(question: str, file_names: List[str]):
     file_paths = [COLLECTIONS + name for name in file_names]
 
-    acc = query_document(
+    return query_document(
         file_paths=file_paths,
         query=question,
         chunk_topk=10,
@@ -16,45 +42,280 @@ def answer(question: str, file_names: List[str]) -> str:
         related_topk=2
     )
 
-    page_summaries = run_parallel_pages(question, acc)
+def _synthesis_prompt(
+    question: str,
+    page_summaries: List[str],
+    labels: Optional[List[str]] = None
+) -> str:
+    labels = labels or [f"Page {i}" for i in range(1, len(page_summaries) + 1)]
+
+    # Các summary chia đều budget còn lại sau instruction + câu hỏi + nhãn
+    budget = (
+        doc_budget(question, _synthesis_instruction_tokens(), _context_cfg)
+        - count_tokens(" ".join(labels))
+    )
+    per_summary = max(budget, 0) // max(len(page_summaries), 1)
+    page_summaries = [trim_to_budget(text, question, per_summary) for text in page_summaries]
+    return _synthesis_text(question, page_summaries, labels)
 
-    final_prompt = f"""
-        You are an expert answer synthesizer and factual information integrator specialized in multi-page summarization pipelines. Your responsibility is to combine multiple PARTIAL SUMMARIES into ONE final, complete, and factually accurate answer to the QUESTION. You MUST rely exclusively on the provided summaries; external knowledge, assumptions, inference, or logical extension beyond the text are strictly forbidden. TASK: Combine and consolidate the PARTIAL SUMMARIES from multiple pages into a single coherent answer that directly addresses the QUESTION, including ONLY information explicitly stated in the summaries. QUESTION (authoritative language source): {question}. PARTIAL SUMMARIES (source-locked): Page 1: {page_summaries[0]}. Page 2: {page_summaries[1]}. Page 3: {page_summaries[2]}. STRICT RULES: (1) Language enforcement: detect the language of the QUESTION and respond ONLY in the same language; do not translate or mix languages; this overrides the summaries’ language. (2) Source confinement: use ONLY information explicitly present in the PARTIAL SUMMARIES; do not infer, assume, or extend facts; if information is missing, explicitly state it is not available. (3) Fact preservation: preserve factual details EXACTLY as written for names (people, organizations), dates and time expressions, numerical values and units, locations/place names, titles, roles, and formal designations. (4) Information merging: merge duplicated facts into a single unified statement; prefer chronological ordering when dates exist; do NOT repeat the same fact. (5) Conflict detection: if summaries conflict, explicitly identify the contradiction and specify which page provides which version; do NOT resolve or judge conflicts. (6) Completeness control: if summaries do not fully answer the QUESTION, clearly state what information is missing; do NOT speculate. (7) Relevance filter: ignore off-topic, background, or decorative content not needed to answer the QUESTION. (8) Format constraints: do NOT output source code, JSON, XML, YAML, tables, schemas, or pseudo-code; use plain text only with headings and bullet points; generate structured formats ONLY if the QUESTION explicitly requests them. (9) Fact emphasis: highlight ALL important facts using **bold markdown** and highlight factual content only. OUTPUT FORMAT (MANDATORY): Final Answer – a clear, concise, complete answer addressing the QUESTION using short paragraphs or bullet points, without restating the question or adding opinions. Key Facts Extracted – include ONLY relevant categories appearing in the summaries and omit empty ones: Dates / Time; People / Organizations; Locations; Numerical Data; Events / Decisions. Conflicts or Inconsistencies (if any) – list each contradiction and reference the specific pages involved (Page 1, Page 2, Page 3). FINAL VALIDATION: ensure output language matches the QUESTION, no facts beyond the summaries are added, no code/tables/structured data appear, and all bolded facts exist verbatim in the summaries.
+def _synthesis_text(question: str, page_summaries: List[str], labels: List[str]) -> str:
+    final_prompt = SYNTHESIS_INSTRUCTIONS + f"""        QUESTION (authoritative language source): {question}. PARTIAL SUMMARIES (source-locked): {' '.join(f'{label}: {text}.' for label, text in zip(labels, page_summaries))}
     """
-    print(final_prompt)
     return final_prompt
 
-def run_parallel_pages(
+# =========================
+# ANSWER STRATEGY
+# =========================
+@dataclass
+class AnswerPlan:
+    strategy: str       # "none" | "single" | "map_reduce"
+    pages: List[int]    # rank các page được dùng
+    # map_reduce: (rank, phần main page) cho từng summary; page vượt budget
+    # được cắt thành nhiều phần thay vì bị trim
+    parts: List[Tuple[int, str]] = field(default_factory=list)
+
+def plan_answer(question: str, acc, config: AnswerConfig = AnswerConfig()) -> AnswerPlan:
+    ranked = [
+        (rank, acc.get_page_field(rank, "score"))
+        for rank in range(1, config.max_pages + 1)
+        if acc.get_page(rank)
+    ]
+
+    # Không có page hoặc page tốt nhất quá kém → không gọi LLM
+    if not ranked or ranked[0][1] < config.min_page_score:
+        return AnswerPlan("none", [])
+
+    top_score = ranked[0][1]
+    pages = [
+        rank for rank, score in ranked
+        if score >= config.min_page_score
+        and score >= top_score * config.relative_page_score
+    ]
+
+    # Tổng tài liệu vừa 1 prompt → trả lời 1 lần, không cần map-reduce.
+    # Chỉ 1 page: main vừa budget là đủ (related được trim theo phần còn lại)
+    budget = _doc_budget(question)
+    main_tokens = count_tokens(_main_text(acc, pages))
+    doc_tokens = main_tokens + sum(count_tokens(text) for text in _related_texts(acc, pages))
+    if doc_tokens <= budget or (len(pages) == 1 and main_tokens <= budget):
+        return AnswerPlan("single", pages)
+    return AnswerPlan("map_reduce", pages, _summary_parts(question, acc, pages, config))
+
+def _doc_budget(question: str) -> int:
+    return doc_budget(question, _summary_instruction_tokens(), _context_cfg)
+
+def _summary_parts(
+    question: str,
+    acc,
+    pages: List[int],
+    config: AnswerConfig = AnswerConfig()
+) -> List[Tuple[int, str]]:
+    # Mỗi phần vừa phần budget của main page → pack_summary_context không trim
+    part_budget = int(_doc_budget(question) * _context_cfg.main_page_share)
+    texts = _page_texts(acc, pages)
+
+    # Mỗi page ít nhất 1 phần; phần dư của max_summary_parts ưu tiên page rank cao,
+    # page cần nhiều phần hơn được trim theo câu hỏi
+    need = [max(1, math.ceil(count_tokens(text) / max(part_budget, 1))) for text in texts]
+    alloc = [1] * len(pages)
+    spare = max(config.max_summary_parts - len(pages), 0)
+    for i, n in enumerate(need):
+        extra = min(n - 1, spare)
+        alloc[i] += extra
+        spare -= extra
+
+    return [
+        (rank, part)
+        for rank, text, max_parts in zip(pages, texts, alloc)
+        for part in split_to_budget(text, part_budget, question, max_parts)
+    ]
+
+def _part_labels(plan: AnswerPlan) -> List[str]:
+    # "Page 2" hoặc "Page 2 part 1" nếu page bị cắt thành nhiều phần
+    ranks = [rank for rank, _ in plan.parts]
+    labels, seen = [], {}
+    for rank in ranks:
+        seen[rank] = seen.get(rank, 0) + 1
+        label = f"Page {plan.pages.index(rank) + 1}"
+        if ranks.count(rank) > 1:
+            label += f" part {seen[rank]}"
+        labels.append(label)
+    return labels
+
+def _page_texts(acc, pages: List[int]) -> List[str]:
+    return [acc.get_page_field(rank, "highlighted_text") or "" for rank in pages]
+
+def _related_texts(acc, pages: List[int]) -> List[str]:
+    # Related page của các page đã chọn, bỏ trùng và bỏ page đã là main
+    seen = {
+        (acc.get_page_field(rank, "collection"), acc.get_page_field(rank, "page"))
+        for rank in pages
+    }
+    texts = []
+    for rank in pages:
+        for rel in acc.get_page(rank).get("related_pages", []):
+            key = (rel["collection"], rel["page"])
+            if key not in seen and rel.get("highlighted_text"):
+                seen.add(key)
+                texts.append(rel["highlighted_text"])
+    return texts
+
+def _main_text(acc, pages: List[int]) -> str:
+    return "\n\n".join(
+        f"[{acc.get_page_field(rank, 'collection')} - page {acc.get_page_field(rank, 'page')}]\n{text}"
+        for rank, text in zip(pages, _page_texts(acc, pages))
+    )
+
+def _single_pass_prompt(question: str, acc, pages: List[int]) -> str:
+    # plan_answer đã kiểm tra main pages vừa budget → không bị trim ở đây
+    main_page_text, related_pages = pack_single_context(
+        question,
+        _main_text(acc, pages),
+        _related_texts(acc, pages),
+        _summary_instruction_tokens(),
+        _context_cfg
+    )
+    return summary(
+        query=question,
+        main_page_text=main_page_text,
+        related_pages=related_pages
+    )
+
+def answer(question: str, file_names: List[str]) -> Optional[str]:
+    # Trả về prompt cuối, hoặc None nếu tài liệu không có thông tin liên quan
+    acc = _retrieve(question, file_names)
+    plan = plan_answer(question, acc)
+
+    if plan.strategy == "none":
+        return None
+
+    if plan.strategy == "single":
+        with span("answer.pack_context"):
+            final_prompt = _single_pass_prompt(question, acc, plan.pages)
+    else:
+        with span("answer.page_summaries"):
+            page_summaries = run_parallel_pages(question, acc, plan.parts)
+        final_prompt = _synthesis_prompt(question, page_summaries, _part_labels(plan))
+
+    logger.debug("Final prompt: %s", final_prompt)
+    return final_prompt
+
+def prepare_answer(question: str, file_names: List[str]) -> Tuple[object, AnswerPlan]:
+    # Phần CPU (retrieval, rerank, chọn strategy), không chờ LLM
+    acc = _retrieve(question, file_names)
+    return acc, plan_answer(question, acc)
+
+def answer_events(
+    question: str,
+    file_names: List[str],
+    prepared: Optional[Tuple[object, AnswerPlan]] = None
+) -> Iterator[dict]:
+    # Stream tiến trình: retrieval → từng page summary → token câu trả lời cuối
+    yield {"event": "start"}
+
+    acc, plan = prepared or prepare_answer(question, file_names)
+
+    yield {
+        "event": "retrieval",
+        "strategy": plan.strategy,
+        "sources": [
+            {
+                "rank": rank,
+                "collection": acc.get_page_field(rank, "collection"),
+                "page": acc.get_page_field(rank, "page"),
+                "score": acc.get_page_field(rank, "score")
+            }
+            for rank in plan.pages
+        ]
+    }
+
+    if plan.strategy == "none":
+        yield {"event": "token", "text": NO_ANSWER_MESSAGE}
+        yield {"event": "done"}
+        return
+
+    if plan.strategy == "single":
+        with span("answer.pack_context"):
+            final_prompt = _single_pass_prompt(question, acc, plan.pages)
+    else:
+        page_summaries = [None] * len(plan.parts)
+        labels = _part_labels(plan)
+        for i, text in run_parallel_pages_iter(question, acc, plan.parts):
+            page_summaries[i] = text
+            rank = plan.parts[i][0]
+            yield {
+                "event": "summary",
+                "rank": rank,
+                "label": labels[i],
+                "collection": acc.get_page_field(rank, "collection"),
+                "page": acc.get_page_field(rank, "page"),
+                "text": text
+            }
+        final_prompt = _synthesis_prompt(question, page_summaries, labels)
+
+    for token in generate_stream(final_prompt):
+        yield {"event": "token", "text": token}
+
+    yield {"event": "done"}
+
+@lru_cache(maxsize=1)
+def _synthesis_instruction_tokens() -> int:
+    # Số token của phần instruction cố định (không có summary)
+    return count_tokens(_synthesis_text(question="", page_summaries=[], labels=[]))
+
+@lru_cache(maxsize=1)
+def _summary_instruction_tokens() -> int:
+    # Số token của phần instruction cố định (tài liệu rỗng)
+    return count_tokens(summary(query="", main_page_text="", related_pages=[]))
+
+def _summary_prompts(
     query: str,
     acc,
-    page_indices: List[int] = [1, 2, 3]
+    parts: List[Tuple[int, str]]
 ) -> List[str]:
-    results = [None] * len(page_indices)
-
-    def worker(idx: int, page_idx: int):
-        main_page_text = acc.get_page_field(page_idx, "highlighted_text")
+    prompts = []
 
+    for page_idx, main_page_text in parts:
         related_pages = [
             acc.get_related_field(page_idx, 1, "highlighted_text"),
             acc.get_related_field(page_idx, 2, "highlighted_text"),
         ]
 
-        prompt = summary(
+        # Cắt tài liệu theo budget token, ưu tiên đoạn liên quan tới câu hỏi
+        main_page_text, related_pages = pack_summary_context(
+            query,
+            main_page_text,
+            related_pages,
+            _summary_instruction_tokens(),
+            _context_cfg
+        )
+
+        prompts.append(summary(
             query=query,
             main_page_text=main_page_text,
             related_pages=related_pages
-        )
+        ))
 
-        results[idx] = generate_text(prompt)
+    return prompts
 
-    threads = []
-
-    for i, page_idx in enumerate(page_indices):
-        t = threading.Thread(target=worker, args=(i, page_idx))
-        t.start()
-        threads.append(t)
-    for t in threads:
-        t.join()
-
-    return results
+def run_parallel_pages(
+    query: str,
+    acc,
+    parts: List[Tuple[int, str]]
+) -> List[str]:
+    # Một lần generate cho tất cả page summary
+    return generate_batch(
+        _summary_prompts(query, acc, parts),
+        _summary_gen_cfg
+    )
 
+def run_parallel_pages_iter(
+    query: str,
+    acc,
+    parts: List[Tuple[int, str]]
+) -> Iterator[Tuple[int, str]]:
+    # Cùng batch như run_parallel_pages, nhưng trả từng summary ngay khi xong
+    yield from generate_as_completed(
+        _summary_prompts(query, acc, parts),
+        _summary_gen_cfg
+    )
@@ -1,8 +1,11 @@
 import os
+import logging
 from typing import List
 from doc_knowledge.search_utils import DOCSearcher
 from doc_knowledge.result_accessor import SearchResultAccessor
-from doc_knowledge.vectordb_utils import QdrantFileUploader
+from doc_knowledge.vectordb_utils import QdrantFileUploader, is_indexing
+
+logger = logging.getLogger(__name__)
 
 
 def query_document(
@@ -16,13 +19,15 @@ def query_document(
     collections = []
 
     # ===== 1. Load hoặc upload tất cả file =====
+    uploader = QdrantFileUploader()
     for file_path in file_paths:
         file_name = os.path.basename(file_path)
         collection_name = f"doc_{file_name}"
 
-        loaded = QdrantFileUploader().load_collection(collection_name)
-        if not loaded:
-            collection_name = QdrantFileUploader().upload_file(file_path)
+        # Chưa có collection, hoặc job ingest nền đang ghi → upload_file chờ
+        # lock của collection (job xong thì file không đổi, bỏ qua)
+        if is_indexing(collection_name) or not uploader.load_collection(collection_name):
+            collection_name = uploader.upload_file(file_path)
 
         collections.append(collection_name)
 
@@ -35,7 +40,7 @@ def query_document(
     )
 
     results = searcher.search(query)
-    print(results)
+    logger.debug("Search results: %s", results)
 
     # ===== 3. Wrap accessor =====
     return SearchResultAccessor(results)
@@ -8,7 +8,7 @@ import torch
 @dataclass
 class ModelConfig:
     model_name: str = "meta-llama/Llama-3.2-3B-Instruct"
-    device_map: str = "cuda"
+    device_map: str = "auto"   # "auto" = cuda nếu có, không thì cpu
     torch_dtype: torch.dtype = torch.float16
     trust_remote_code: bool = False
     low_cpu_mem_usage: bool = True
@@ -21,13 +21,16 @@ class ModelConfig:
     use_fast_tokenizer: bool = True
     use_cache: bool = True
 
+    # Độ dài context tối đa của model (prompt + token sinh ra)
+    max_context_tokens: int = 131072
+
 
 # =========================
 # GENERATION CONFIG
 # =========================
 @dataclass
 class GenerationConfig:
-    max_new_tokens: int = 128000
+    max_new_tokens: int = 1024
     temperature: float = 0.2
     top_p: float = 0.9
     top_k: int = 50
@@ -35,3 +38,33 @@ class GenerationConfig:
     repetition_penalty: float = 1.2
     num_beams: int = 1
     stop_token_id: Optional[int] = None
+
+
+# =========================
+# SCHEDULER CONFIG
+# =========================
+@dataclass
+class SchedulerConfig:
+    max_batch_size: int = 8     # số sequence decode đồng thời
+    max_waiting: int = 64       # số request chờ tối đa (quá → từ chối)
+
+
+# =========================
+# CONTEXT BUDGET CONFIG
+# =========================
+@dataclass
+class ContextConfig:
+    prompt_budget: int = 6144           # token tối đa cho 1 prompt (instruction + tài liệu)
+    main_page_share: float = 0.6        # phần budget tài liệu dành cho main page
+    summary_max_new_tokens: int = 512   # giới hạn token sinh cho mỗi page summary
+
+
+# =========================
+# ANSWER STRATEGY CONFIG
+# =========================
+@dataclass
+class AnswerConfig:
+    max_pages: int = 3                  # số page tối đa đưa vào câu trả lời
+    min_page_score: float = 0.05        # page top thấp hơn → trả lời "không có thông tin"
+    relative_page_score: float = 0.5    # giữ page có score >= tỉ lệ này * score page top
+    max_summary_parts: int = 3          # số summary tối đa ở map-reduce (page dài bị trim)
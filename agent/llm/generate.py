@@ -1,36 +1,100 @@
+from concurrent.futures import as_completed
+from typing import Iterator, List, Tuple
 import torch
-import threading
-from transformers import (
-    AutoTokenizer,
-    AutoModelForCausalLM,
-    TextIteratorStreamer
-)
 
-from llm.config import ModelConfig, GenerationConfig
+from llm.config import ModelConfig, GenerationConfig, SchedulerConfig
+from llm.scheduler import InferenceScheduler
+from registry import models, select_device
 
 # =========================
-# LOAD MODEL (ONCE)
+# LOAD MODEL (LAZY, ONCE)
 # =========================
 _model_cfg = ModelConfig()
+_device = select_device(_model_cfg.device_map)
+_prefixes: List[str] = []
+
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(
+        _model_cfg.model_name,
+        use_fast=_model_cfg.use_fast_tokenizer,
+        trust_remote_code=_model_cfg.trust_remote_code
+    )
+
+
+def _load_model():
+    from transformers import AutoModelForCausalLM
+    quantized = _model_cfg.load_in_8bit or _model_cfg.load_in_4bit
+
+    model = AutoModelForCausalLM.from_pretrained(
+        _model_cfg.model_name,
+        # fp16 trên CPU chậm và thiếu kernel → dùng fp32
+        torch_dtype=_model_cfg.torch_dtype if _device != "cpu" else torch.float32,
+        trust_remote_code=_model_cfg.trust_remote_code,
+        load_in_8bit=_model_cfg.load_in_8bit,
+        load_in_4bit=_model_cfg.load_in_4bit,
+        low_cpu_mem_usage=_model_cfg.low_cpu_mem_usage,
+        device_map=_device if quantized else None
+    )
+
+    model.config.use_cache = _model_cfg.use_cache
+    if not quantized:
+        model.to(_device)
+    model.eval()
+    return model
+
+
+# =========================
+# SCHEDULER (OWNS THE MODEL)
+# =========================
+# Mọi request sinh text đi qua scheduler để được batch chung theo từng bước decode
+def _load_scheduler():
+    scheduler = InferenceScheduler(
+        models.get("llm"),
+        get_tokenizer(),
+        _device,
+        SchedulerConfig(),
+        max_context_tokens=_model_cfg.max_context_tokens
+    )
+    for prefix in _prefixes:
+        scheduler.register_prefix(prefix)
+    return scheduler
+
+
+def _warmup_llm(scheduler):
+    scheduler.submit("warmup", GenerationConfig(max_new_tokens=1)).result()
+
+
+models.register("llm_tokenizer", _load_tokenizer)
+models.register("llm", _load_model)
+models.register("llm_scheduler", _load_scheduler, warmup=_warmup_llm)
+
+
+def get_tokenizer():
+    return models.get("llm_tokenizer")
+
+
+def get_scheduler() -> InferenceScheduler:
+    return models.get("llm_scheduler")
+
+
+def register_prefix(prefix: str):
+    # Prompt bắt đầu bằng prefix này sẽ dùng lại KV cache đã tính sẵn
+    if prefix not in _prefixes:
+        _prefixes.append(prefix)
+    if models.is_loaded("llm_scheduler"):
+        get_scheduler().register_prefix(prefix)
+
+
+def llm_queue_depth() -> int:
+    # Scheduler chưa load → chưa có request nào chờ
+    return get_scheduler().queue_depth() if models.is_loaded("llm_scheduler") else 0
+
+
+def llm_saturated() -> bool:
+    return models.is_loaded("llm_scheduler") and get_scheduler().is_full()
 
-tokenizer = AutoTokenizer.from_pretrained(
-    _model_cfg.model_name,
-    use_fast=_model_cfg.use_fast_tokenizer,
-    trust_remote_code=_model_cfg.trust_remote_code
-)
-
-model = AutoModelForCausalLM.from_pretrained(
-    _model_cfg.model_name,
-    torch_dtype=_model_cfg.torch_dtype,
-    trust_remote_code=_model_cfg.trust_remote_code,
-    load_in_8bit=_model_cfg.load_in_8bit,
-    load_in_4bit=_model_cfg.load_in_4bit,
-    low_cpu_mem_usage=_model_cfg.low_cpu_mem_usage
-)
-
-model.config.use_cache = _model_cfg.use_cache
-model.to(_model_cfg.device_map)
-model.eval()
 # =========================
 # NORMAL GENERATION (NO STREAM)
 # =========================
@@ -38,27 +102,50 @@ def generate_text(
     prompt: str,
     gen_config: GenerationConfig = GenerationConfig()
 ) -> str:
-    inputs = tokenizer(prompt, return_tensors="pt").to(_model_cfg.device_map)
-
-    gen_kwargs = dict(
-        **inputs,
-        max_new_tokens=gen_config.max_new_tokens,
-        temperature=gen_config.temperature,
-        top_p=gen_config.top_p,
-        top_k=gen_config.top_k,
-        do_sample=gen_config.do_sample,
-        repetition_penalty=gen_config.repetition_penalty,
-        num_beams=gen_config.num_beams,
-        pad_token_id=tokenizer.eos_token_id,
-        eos_token_id=gen_config.stop_token_id or tokenizer.eos_token_id,
-        use_cache=True
-    )
+    return get_scheduler().submit(prompt, gen_config).result()
 
-    with torch.no_grad():
-        outputs = model.generate(**gen_kwargs)
+# =========================
+# BATCH GENERATION (NO STREAM)
+# =========================
+def _submit_all(prompts: List[str], gen_config: GenerationConfig):
+    # Một prompt bị từ chối (SchedulerBusy, quá context) → hủy các prompt đã gửi
+    scheduler = get_scheduler()
+    requests = []
+    try:
+        for prompt in prompts:
+            requests.append(scheduler.submit(prompt, gen_config))
+    except Exception:
+        for req in requests:
+            req.cancel()
+        raise
+    return requests
 
-    text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return text[len(prompt):].strip()
+def generate_batch(
+    prompts: List[str],
+    gen_config: GenerationConfig = GenerationConfig()
+) -> List[str]:
+    # Gửi tất cả prompt cùng lúc → cùng vào một batch decode
+    requests = _submit_all(prompts, gen_config)
+    try:
+        return [req.result() for req in requests]
+    finally:
+        for req in requests:
+            req.cancel()
+
+def generate_as_completed(
+    prompts: List[str],
+    gen_config: GenerationConfig = GenerationConfig()
+) -> Iterator[Tuple[int, str]]:
+    # Như generate_batch nhưng trả (index, text) ngay khi từng prompt sinh xong
+    requests = _submit_all(prompts, gen_config)
+    index = {req.future: i for i, req in enumerate(requests)}
+    try:
+        for future in as_completed(index):
+            yield index[future], future.result()
+    finally:
+        # Consumer dừng sớm / lỗi → không để các prompt còn lại chạy tiếp
+        for req in requests:
+            req.cancel()
 
 # =========================
 # STREAM GENERATION
@@ -66,34 +153,6 @@ def generate_text(
 def generate_stream(
     prompt: str,
     gen_config: GenerationConfig = GenerationConfig()
-):
-    inputs = tokenizer(prompt, return_tensors="pt").to(_model_cfg.device_map)
-
-    gen_kwargs = dict(
-        **inputs,
-        max_new_tokens=gen_config.max_new_tokens,
-        temperature=gen_config.temperature,
-        top_p=gen_config.top_p,
-        top_k=gen_config.top_k,
-        do_sample=gen_config.do_sample,
-        repetition_penalty=gen_config.repetition_penalty,
-        num_beams=gen_config.num_beams,
-        pad_token_id=tokenizer.eos_token_id,
-        eos_token_id=gen_config.stop_token_id or tokenizer.eos_token_id,
-        use_cache=True
-    )
-
-    streamer = TextIteratorStreamer(
-        tokenizer,
-        skip_prompt=True,
-        skip_special_tokens=True
-    )
-    gen_kwargs["streamer"] = streamer
-
-    def _run():
-        model.generate(**gen_kwargs)
-
-    threading.Thread(target=_run, daemon=True).start()
-
-    for token in streamer:
-        yield token
+) -> Iterator[str]:
+    # Submit ngay để SchedulerBusy báo lỗi trước khi response bắt đầu stream
+    return get_scheduler().submit(prompt, gen_config, stream=True).stream()
@@ -0,0 +1,528 @@
+import time
+import queue
+import logging
+import threading
+from dataclasses import replace
+from concurrent.futures import Future
+from typing import Iterator, List, Optional
+
+import torch
+from transformers import (
+    DynamicCache,
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper
+)
+
+import tracing
+from metrics import Counter, Gauge, Histogram
+from llm.config import GenerationConfig, SchedulerConfig
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUESTS = Counter(
+    "deepdoc_llm_requests_total", "LLM generate calls", ["status"]
+)
+LLM_PROMPT_TOKENS = Counter(
+    "deepdoc_llm_prompt_tokens_total", "Prompt tokens submitted to the LLM"
+)
+LLM_PREFILL_TOKENS = Counter(
+    "deepdoc_llm_prefill_tokens_total", "Prompt tokens actually prefilled (after prefix KV reuse)"
+)
+LLM_GENERATED_TOKENS = Counter(
+    "deepdoc_llm_generated_tokens_total", "Tokens generated by the LLM"
+)
+LLM_TTFT_SECONDS = Histogram(
+    "deepdoc_llm_time_to_first_token_seconds", "Queue wait + prefill per LLM call"
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "deepdoc_llm_tokens_per_second", "Decode throughput per LLM call",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+LLM_WAITING = Gauge("deepdoc_llm_waiting_requests", "Requests waiting for a batch slot")
+LLM_ACTIVE = Gauge("deepdoc_llm_active_sequences", "Sequences in the decode batch")
+
+
+class SchedulerBusy(RuntimeError):
+    pass
+
+
+# =========================
+# REQUEST
+# =========================
+class _Request:
+    def __init__(
+        self,
+        input_ids: torch.Tensor,
+        gen_config: GenerationConfig,
+        stop_ids: set,
+        stream: bool
+    ):
+        self.input_ids = input_ids          # (1, prompt_len)
+        self.prefix: Optional[str] = None   # prefix đã có KV cache sẵn
+        self.prefix_len = 0
+        self.gen_config = gen_config
+        self.cancelled = False
+        self.stop_ids = stop_ids
+        self.generated: List[int] = []
+        self.future = Future()
+        self.queue: Optional[queue.Queue] = queue.Queue() if stream else None
+
+        # Đo thời gian: ghi vào trace của request đã submit
+        self.trace = tracing.current()
+        self.submitted = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+        # Trạng thái decode text tăng dần (giống TextIteratorStreamer)
+        self._token_cache: List[int] = []
+        self._printed = 0
+
+        # prompt + token đã sinh cho logits processor, cấp phát 1 lần, ghi dần
+        self._history: Optional[torch.Tensor] = None
+        self._history_len = 0
+
+        self.processors = LogitsProcessorList()
+        if gen_config.repetition_penalty and gen_config.repetition_penalty != 1.0:
+            self.processors.append(
+                RepetitionPenaltyLogitsProcessor(gen_config.repetition_penalty)
+            )
+        if gen_config.do_sample:
+            if gen_config.temperature and gen_config.temperature != 1.0:
+                self.processors.append(TemperatureLogitsWarper(gen_config.temperature))
+            if gen_config.top_k:
+                self.processors.append(TopKLogitsWarper(gen_config.top_k))
+            if gen_config.top_p and gen_config.top_p < 1.0:
+                self.processors.append(TopPLogitsWarper(gen_config.top_p))
+
+    def cancel(self):
+        # Scheduler bỏ request ở bước decode kế tiếp (client ngắt, batch lỗi)
+        if not self.future.done():
+            self.cancelled = True
+
+    def history(self, device) -> torch.Tensor:
+        if self._history is None:
+            prompt_len = self.input_ids.shape[1]
+            self._history = torch.empty(
+                (1, prompt_len + self.gen_config.max_new_tokens),
+                dtype=torch.long,
+                device=device
+            )
+            self._history[:, :prompt_len] = self.input_ids
+            self._history_len = prompt_len
+            for token in self.generated:
+                self._push_history(token)
+        return self._history[:, :self._history_len]
+
+    def _push_history(self, token: int):
+        self._history[0, self._history_len] = token
+        self._history_len += 1
+
+    def append(self, token: int):
+        self.generated.append(token)
+        self._token_cache.append(token)
+        if self._history is not None:
+            self._push_history(token)
+
+    def stream(self) -> Iterator[str]:
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stream bị đóng giữa chừng → giải phóng slot trong batch
+            self.cancel()
+
+    def result(self) -> str:
+        return self.future.result()
+
+
+# =========================
+# CONTINUOUS-BATCHING SCHEDULER
+# =========================
+class InferenceScheduler:
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        device,
+        config: SchedulerConfig = SchedulerConfig(),
+        max_context_tokens: Optional[int] = None
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.config = config
+        self.max_context_tokens = max_context_tokens
+
+        self._waiting = queue.Queue(maxsize=config.max_waiting)
+
+        # Prefix tĩnh (instruction) → token ids / KV cache tính 1 lần
+        self._prefixes: List[str] = []
+        self._prefix_ids = {}
+        self._prefix_kv = {}
+        self._prefix_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._reset()
+
+        LLM_WAITING.set_function(self.queue_depth)
+        LLM_ACTIVE.set_function(self.active_count)
+
+    def _reset(self):
+        # Batch đang decode: mỗi dòng là một request
+        self._active: List[_Request] = []
+        self._cache = None            # legacy: [(k, v)] mỗi tensor (B, H, L, D)
+        self._mask = None             # (B, L)
+        self._next_tokens = None      # (B, 1)
+        self._positions = None        # (B,)
+
+    # ---------- public ----------
+    def register_prefix(self, prefix: str):
+        with self._prefix_lock:
+            if prefix in self._prefix_ids:
+                return
+            self._prefix_ids[prefix] = self.tokenizer(prefix)["input_ids"]
+            self._prefixes.append(prefix)
+            self._prefixes.sort(key=len, reverse=True)
+
+    def _tokenize(self, prompt: str):
+        # Prompt bắt đầu bằng prefix đã đăng ký → ghép ids prefix + phần còn lại
+        # để phần đầu luôn khớp KV cache của prefix
+        with self._prefix_lock:
+            prefix = next((p for p in self._prefixes if prompt.startswith(p)), None)
+            prefix_ids = self._prefix_ids.get(prefix)
+
+        if prefix is None or len(prompt) == len(prefix):
+            return self.tokenizer(prompt, return_tensors="pt")["input_ids"], None, 0
+
+        suffix_ids = self.tokenizer(
+            prompt[len(prefix):],
+            add_special_tokens=False
+        )["input_ids"]
+        return torch.tensor([prefix_ids + suffix_ids]), prefix, len(prefix_ids)
+
+    def submit(
+        self,
+        prompt: str,
+        gen_config: GenerationConfig = GenerationConfig(),
+        stream: bool = False
+    ) -> _Request:
+        input_ids, prefix, prefix_len = self._tokenize(prompt)
+
+        # Không sinh quá phần context còn lại sau prompt
+        if self.max_context_tokens:
+            remaining = self.max_context_tokens - input_ids.shape[1]
+            if remaining <= 0:
+                raise ValueError(
+                    f"Prompt has {input_ids.shape[1]} tokens, "
+                    f"exceeds context of {self.max_context_tokens}"
+                )
+            if gen_config.max_new_tokens > remaining:
+                gen_config = replace(gen_config, max_new_tokens=remaining)
+
+        stop_id = gen_config.stop_token_id or self.tokenizer.eos_token_id
+        req = _Request(input_ids, gen_config, {stop_id}, stream)
+        req.prefix, req.prefix_len = prefix, prefix_len
+
+        self._ensure_started()
+        try:
+            self._waiting.put_nowait(req)
+        except queue.Full:
+            LLM_REQUESTS.inc(status="rejected")
+            raise SchedulerBusy("Inference queue is full")
+        LLM_PROMPT_TOKENS.inc(input_ids.shape[1])
+        return req
+
+    def queue_depth(self) -> int:
+        return self._waiting.qsize()
+
+    def is_full(self) -> bool:
+        return self._waiting.full()
+
+    def active_count(self) -> int:
+        return len(self._active)
+
+    # ---------- loop ----------
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            # Rảnh → chờ request mới; đang chạy → chỉ lấy request có sẵn
+            if not self._active:
+                self._admit(self._waiting.get())
+            while len(self._active) < self.config.max_batch_size:
+                try:
+                    self._admit(self._waiting.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._drop_cancelled()
+            if self._active:
+                try:
+                    self._step()
+                except Exception as e:
+                    logger.exception("Scheduler error")
+                    for req in self._active:
+                        self._fail(req, e)
+                    self._reset()
+
+    def _drop_cancelled(self):
+        keep = [i for i, req in enumerate(self._active) if not req.cancelled]
+        if len(keep) == len(self._active):
+            return
+        for req in self._active:
+            if req.cancelled:
+                self._finish_cancelled(req)
+        if keep:
+            self._next_tokens = self._next_tokens.index_select(
+                0, torch.tensor(keep, device=self.device)
+            )
+        self._leave(keep)
+
+    def _admit(self, req: _Request):
+        if req.cancelled:
+            self._finish_cancelled(req)
+            return
+
+        start = time.perf_counter()
+        tracing.record("llm.queue_wait", start - req.submitted, req.trace)
+        try:
+            cache, first_token = self._prefill(req)
+        except Exception as e:
+            logger.exception("Scheduler prefill error")
+            self._fail(req, e)
+            return
+
+        req.first_token_at = time.perf_counter()
+        tracing.record("llm.prefill", req.first_token_at - start, req.trace)
+        LLM_TTFT_SECONDS.observe(req.first_token_at - req.submitted)
+        LLM_PREFILL_TOKENS.inc(req.input_ids.shape[1] - req.prefix_len)
+
+        if self._emit(req, first_token):
+            return
+        self._join(req, cache, first_token)
+
+    # ---------- model ----------
+    @torch.no_grad()
+    def _get_prefix_kv(self, prefix: str):
+        # KV cache của prefix chỉ đọc, các request dùng chung (torch.cat tạo tensor mới)
+        if prefix not in self._prefix_kv:
+            ids = torch.tensor([self._prefix_ids[prefix]], device=self.device)
+            out = self.model(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                use_cache=True
+            )
+            self._prefix_kv[prefix] = _to_legacy(out.past_key_values)
+        return self._prefix_kv[prefix]
+
+    @torch.no_grad()
+    def _prefill(self, req: _Request):
+        input_ids = req.input_ids.to(self.device)
+
+        if req.prefix is not None:
+            # Chỉ prefill phần sau prefix
+            past = _from_legacy(self._get_prefix_kv(req.prefix))
+            start, end = req.prefix_len, input_ids.shape[1]
+            out = self.model(
+                input_ids=input_ids[:, start:],
+                attention_mask=torch.ones_like(input_ids),
+                position_ids=torch.arange(start, end, device=self.device).unsqueeze(0),
+                past_key_values=past,
+                use_cache=True
+            )
+        else:
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                use_cache=True
+            )
+
+        token = self._sample(req, out.logits[:, -1, :])
+        return _to_legacy(out.past_key_values), token
+
+    @torch.no_grad()
+    def _step(self):
+        batch = len(self._active)
+        self._mask = torch.cat(
+            [self._mask, self._mask.new_ones((batch, 1))], dim=1
+        )
+        out = self.model(
+            input_ids=self._next_tokens,
+            attention_mask=self._mask,
+            position_ids=self._positions.unsqueeze(1),
+            past_key_values=_from_legacy(self._cache),
+            use_cache=True
+        )
+        self._cache = _to_legacy(out.past_key_values)
+        self._positions = self._positions + 1
+
+        keep, tokens = [], []
+        for row, req in enumerate(self._active):
+            token = self._sample(req, out.logits[row:row + 1, -1, :])
+            if not self._emit(req, token):
+                keep.append(row)
+                tokens.append(token)
+
+        # Request xong rời batch ngay sau bước decode này
+        if len(keep) < batch:
+            self._leave(keep)
+        if self._active:
+            self._next_tokens = torch.tensor(
+                [[t] for t in tokens], device=self.device
+            )
+
+    def _sample(self, req: _Request, logits: torch.Tensor) -> int:
+        logits = logits.float()
+        if req.processors:
+            logits = req.processors(req.history(logits.device), logits)
+        if req.gen_config.do_sample:
+            probs = torch.softmax(logits, dim=-1)
+            return int(torch.multinomial(probs, num_samples=1)[0, 0])
+        return int(torch.argmax(logits, dim=-1)[0])
+
+    # ---------- batch bookkeeping ----------
+    def _join(self, req: _Request, cache, first_token: int):
+        prompt_len = req.input_ids.shape[1]
+        mask = torch.ones((1, prompt_len), dtype=torch.long, device=self.device)
+        token = torch.tensor([[first_token]], device=self.device)
+        position = torch.tensor([prompt_len], device=self.device)
+
+        if not self._active:
+            self._cache, self._mask = cache, mask
+            self._next_tokens, self._positions = token, position
+        else:
+            # Left-pad cache và mask về cùng độ dài rồi ghép theo batch
+            length = max(self._mask.shape[1], prompt_len)
+            self._cache = [
+                (
+                    torch.cat([_pad_left(k0, length), _pad_left(k1, length)], dim=0),
+                    torch.cat([_pad_left(v0, length), _pad_left(v1, length)], dim=0)
+                )
+                for (k0, v0), (k1, v1) in zip(self._cache, cache)
+            ]
+            self._mask = torch.cat(
+                [_pad_left(self._mask, length), _pad_left(mask, length)], dim=0
+            )
+            self._next_tokens = torch.cat([self._next_tokens, token], dim=0)
+            self._positions = torch.cat([self._positions, position], dim=0)
+
+        self._active.append(req)
+
+    def _leave(self, keep: List[int]):
+        self._active = [self._active[i] for i in keep]
+        if not self._active:
+            self._reset()
+            return
+
+        idx = torch.tensor(keep, device=self.device)
+        mask = self._mask.index_select(0, idx)
+
+        # Bỏ các cột pad ở đầu mà không dòng nào còn dùng
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        self._mask = mask[:, start:]
+        self._cache = [
+            (k.index_select(0, idx)[:, :, start:], v.index_select(0, idx)[:, :, start:])
+            for k, v in self._cache
+        ]
+        self._positions = self._positions.index_select(0, idx)
+
+    # ---------- output ----------
+    def _emit(self, req: _Request, token: int) -> bool:
+        # Trả về True nếu request đã kết thúc
+        finished = token in req.stop_ids
+        if not finished:
+            req.append(token)
+            self._push_text(req, final=False)
+            finished = len(req.generated) >= req.gen_config.max_new_tokens
+
+        if finished:
+            self._observe(req)
+            self._push_text(req, final=True)
+            text = self.tokenizer.decode(req.generated, skip_special_tokens=True)
+            if req.queue is not None:
+                req.queue.put(None)
+            req.future.set_result(text.strip())
+        return finished
+
+    def _push_text(self, req: _Request, final: bool):
+        if req.queue is None:
+            return
+        text = self.tokenizer.decode(req._token_cache, skip_special_tokens=True)
+
+        if final or text.endswith("\n"):
+            delta = text[req._printed:]
+            req._token_cache, req._printed = [], 0
+        elif text.endswith("�"):
+            # Ký tự UTF-8 chưa đủ byte → chờ token tiếp theo
+            return
+        else:
+            end = text.rfind(" ") + 1
+            delta = text[req._printed:end]
+            req._printed = max(req._printed, end)
+
+        if delta:
+            req.queue.put(delta)
+
+    def _observe(self, req: _Request):
+        # Gọi trước khi trả kết quả để trace của request còn mở
+        decode = time.perf_counter() - req.first_token_at
+        n = len(req.generated)
+        tracing.record("llm.decode", decode, req.trace)
+        tracing.count("llm.prompt_tokens", req.input_ids.shape[1], req.trace)
+        tracing.count("llm.generated_tokens", n, req.trace)
+        LLM_GENERATED_TOKENS.inc(n)
+        LLM_REQUESTS.inc(status="ok")
+        if n > 1 and decode > 0:
+            # Token đầu tiên thuộc prefill
+            LLM_TOKENS_PER_SECOND.observe((n - 1) / decode)
+
+    def _finish_cancelled(self, req: _Request):
+        LLM_REQUESTS.inc(status="cancelled")
+        tracing.count("llm.cancelled", 1, req.trace)
+        if req.queue is not None:
+            req.queue.put(None)
+        req.future.cancel()
+
+    def _fail(self, req: _Request, error: Exception):
+        LLM_REQUESTS.inc(status="error")
+        if req.queue is not None:
+            req.queue.put(error)
+        if not req.future.done():
+            req.future.set_exception(error)
+
+
+def _to_legacy(cache):
+    # transformers 5 bỏ to_legacy_cache → đọc keys/values từng layer
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return cache
+
+
+def _from_legacy(cache):
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(cache)
+    return DynamicCache(cache)
+
+
+def _pad_left(x: torch.Tensor, length: int) -> torch.Tensor:
+    # Pad chiều sequence (KV: dim 2, mask: dim 1) bằng 0 ở bên trái
+    seq_dim = 2 if x.dim() == 4 else 1
+    pad = length - x.shape[seq_dim]
+    if pad <= 0:
+        return x
+    shape = list(x.shape)
+    shape[seq_dim] = pad
+    return torch.cat([x.new_zeros(shape), x], dim=seq_dim)
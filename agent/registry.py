@@ -0,0 +1,80 @@
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+import torch
+
+
+# =========================
+# DEVICE
+# =========================
+def select_device(preferred: Optional[str] = None) -> str:
+    # "auto" / None → DEEPDOC_DEVICE nếu có, không thì cuda nếu có GPU, còn lại cpu;
+    # yêu cầu cuda khi không có GPU → cpu
+    if preferred in (None, "auto"):
+        preferred = os.environ.get("DEEPDOC_DEVICE") or "auto"
+    if preferred == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if preferred.startswith("cuda") and not torch.cuda.is_available():
+        print(f"Device '{preferred}' không khả dụng, dùng cpu")
+        return "cpu"
+    return preferred
+
+
+# =========================
+# MODEL REGISTRY (LAZY, THREAD-SAFE)
+# =========================
+class ModelRegistry:
+    def __init__(self):
+        self._loaders: Dict[str, Callable] = {}
+        self._warmups: Dict[str, Callable] = {}
+        self._models = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable, warmup: Optional[Callable] = None):
+        # Đăng ký lại (vd. model thay thế khi benchmark) sẽ bỏ instance cũ
+        with self._lock:
+            self._loaders[name] = loader
+            self._models.pop(name, None)
+            self._locks.setdefault(name, threading.Lock())
+            if warmup is None:
+                self._warmups.pop(name, None)
+            else:
+                self._warmups[name] = warmup
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            if name not in self._loaders:
+                raise KeyError(f"Model '{name}' is not registered")
+            lock = self._locks[name]
+
+        # Mỗi model một lock → load model này không chặn model khác
+        with lock:
+            model = self._models.get(name)
+            if model is None:
+                print(f"Loading model '{name}'...")
+                model = self._loaders[name]()
+                self._models[name] = model
+        return model
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def warmup(self, *names: str):
+        for name in names:
+            model = self.get(name)
+            hook = self._warmups.get(name)
+            if hook:
+                hook(model)
+
+    def unload(self, name: str):
+        with self._lock:
+            self._models.pop(name, None)
+
+
+models = ModelRegistry()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Chạy từ thư mục gốc hoặc agent/: python -m pytest -q agent/tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,139 @@
+import time
+
+import pytest
+import torch
+
+transformers = pytest.importorskip("transformers")
+
+from llm.config import GenerationConfig, SchedulerConfig
+from llm.scheduler import InferenceScheduler
+
+EOS = 0
+PREFIX = "You are a helpful system. Follow the rules carefully. "
+
+
+# =========================
+# MODEL / TOKENIZER NHỎ (CPU, KHÔNG CẦN TẢI WEIGHT)
+# =========================
+class CharTokenizer:
+    eos_token_id = EOS
+
+    def __call__(self, text, return_tensors=None, add_special_tokens=True):
+        ids = [1 + (ord(c) % 90) for c in text]
+        return {"input_ids": torch.tensor([ids]) if return_tensors else ids}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(32 + i % 90) + (" " if i % 5 == 0 else "") for i in ids)
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=100,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture
+def scheduler(model):
+    return InferenceScheduler(
+        model, CharTokenizer(), "cpu", SchedulerConfig(max_batch_size=4, max_waiting=8)
+    )
+
+
+def _greedy(max_new_tokens: int = 24) -> GenerationConfig:
+    return GenerationConfig(
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        repetition_penalty=1.2,
+        stop_token_id=EOS
+    )
+
+
+def _reference(model, prompt: str, cfg: GenerationConfig):
+    # Token sinh bởi model.generate, bỏ phần sau stop token như scheduler
+    ids = CharTokenizer()(prompt, return_tensors="pt")["input_ids"]
+    with torch.no_grad():
+        out = model.generate(
+            ids,
+            attention_mask=torch.ones_like(ids),
+            max_new_tokens=cfg.max_new_tokens,
+            do_sample=False,
+            repetition_penalty=cfg.repetition_penalty,
+            eos_token_id=EOS,
+            pad_token_id=EOS
+        )
+    tokens = out[0, ids.shape[1]:].tolist()
+    return tokens[:tokens.index(EOS)] if EOS in tokens else tokens
+
+
+def _wait(predicate, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+# =========================
+# TESTS
+# =========================
+def test_single_request_matches_generate(model, scheduler):
+    cfg = _greedy()
+    req = scheduler.submit("hello world", cfg)
+    req.future.result(timeout=30)
+    assert req.generated == _reference(model, "hello world", cfg)
+
+
+def test_staggered_batch_matches_generate(model, scheduler):
+    # Request vào batch khi request khác đang decode (left-pad + ghép KV)
+    cfg = _greedy(32)
+    prompts = ["alpha beta", "gamma", "delta epsilon zeta eta", "x"]
+
+    first = scheduler.submit(prompts[0], cfg)
+    _wait(lambda: len(first.generated) >= 3)
+    second = scheduler.submit(prompts[1], cfg)
+    _wait(lambda: len(second.generated) >= 2)
+    rest = [scheduler.submit(p, cfg) for p in prompts[2:]]
+
+    reqs = [first, second] + rest
+    for req in reqs:
+        req.future.result(timeout=30)
+    for prompt, req in zip(prompts, reqs):
+        assert req.generated == _reference(model, prompt, cfg), prompt
+
+
+def test_prefix_reuse_matches_generate(model, scheduler):
+    cfg = _greedy()
+    scheduler.register_prefix(PREFIX)
+    questions = ["what is x", "tell me about y"]
+
+    reqs = [scheduler.submit(PREFIX + q, cfg) for q in questions]
+    for req in reqs:
+        req.future.result(timeout=30)
+
+    for q, req in zip(questions, reqs):
+        assert req.prefix == PREFIX
+        assert req.generated == _reference(model, PREFIX + q, cfg)
+
+
+def test_cancel_frees_slot(model, scheduler):
+    cfg = _greedy(200)
+    keep = scheduler.submit("alpha beta", _greedy(32))
+    req = scheduler.submit("another prompt", cfg, stream=True)
+
+    stream = req.stream()
+    next(stream)
+    stream.close()
+
+    _wait(lambda: req.future.cancelled())
+    _wait(lambda: scheduler.active_count() == 0)
+    # Request còn lại trong batch không bị ảnh hưởng
+    keep.future.result(timeout=30)
+    assert keep.generated == _reference(model, "alpha beta", _greedy(32))
+    assert len(req.generated) < cfg.max_new_tokens
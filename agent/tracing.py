@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import uuid
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Dict, List, Optional, Tuple
+
+from metrics import Counter, Histogram, STAGE_SECONDS
+
+# DEEPDOC_TRACE_LOG=1 → mỗi request ghi 1 dòng JSON (stage, thời gian, counter)
+TRACE_LOG = os.environ.get("DEEPDOC_TRACE_LOG", "0").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("deepdoc.trace")
+
+REQUEST_SECONDS = Histogram(
+    "deepdoc_request_seconds",
+    "End-to-end duration of traced requests",
+    ["name"]
+)
+REQUESTS = Counter(
+    "deepdoc_requests_total",
+    "Traced requests",
+    ["name", "status"]
+)
+
+
+# =========================
+# TRACE (THỜI GIAN TỪNG STAGE TRONG 1 REQUEST)
+# =========================
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []   # (stage, giây)
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.status = "ok"
+        self._finished = False
+
+    def add(self, stage: str, seconds: float):
+        self.spans.append((stage, seconds))
+
+    def count(self, key: str, value: float = 1):
+        self.counters[key] += value
+
+    def totals(self) -> Dict[str, float]:
+        out = defaultdict(float)
+        for stage, seconds in self.spans:
+            out[stage] += seconds
+        return dict(out)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        elapsed = time.perf_counter() - self.started
+        REQUEST_SECONDS.observe(elapsed, name=self.name)
+        REQUESTS.inc(name=self.name, status=self.status)
+
+        if TRACE_LOG:
+            logger.info(json.dumps({
+                "trace": self.name,
+                "trace_id": self.trace_id,
+                "status": self.status,
+                "total_ms": round(elapsed * 1000, 3),
+                "stages_ms": {k: round(v * 1000, 3) for k, v in self.totals().items()},
+                "counters": dict(self.counters)
+            }, ensure_ascii=False))
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def resume(tr: Optional[Trace]):
+    # Gắn lại trace có sẵn vào context hiện tại (không kết thúc trace)
+    token = _current.set(tr)
+    try:
+        yield tr
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def trace(name: str):
+    tr = Trace(name)
+    try:
+        with resume(tr):
+            yield tr
+    except BaseException:
+        tr.status = "error"
+        raise
+    finally:
+        tr.finish()
+
+
+def traced_iter(tr: Trace, iterable):
+    # Stream response: mỗi lần lấy phần tử chạy trong trace của request,
+    # trace kết thúc khi stream hết (hoặc client ngắt)
+    it = iter(iterable)
+    try:
+        while True:
+            with resume(tr):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                except BaseException:
+                    tr.status = "error"
+                    raise
+            yield item
+    finally:
+        # Client ngắt → đóng stream bên trong ngay (vd. hủy request LLM)
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+        tr.finish()
+
+
+def record(stage: str, seconds: float, tr: Optional[Trace] = None):
+    # Ghi stage đã đo sẵn (vd. từ thread scheduler) vào histogram + trace
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    tr = tr if tr is not None else _current.get()
+    if tr is not None:
+        tr.add(stage, seconds)
+
+
+def count(key: str, value: float = 1, tr: Optional[Trace] = None):
+    tr = tr if tr is not None else _current.get()
+    if tr is not None:
+        tr.count(key, value)
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed_iter(iterable, stage: str):
+    # Cộng dồn thời gian lấy từng phần tử (vd. parse page theo kiểu generator)
+    it = iter(iterable)
+    while True:
+        with span(stage):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def in_context(fn):
+    # Chạy fn trong thread pool mà vẫn ghi span vào trace của request hiện tại
+    ctx = copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)